@@ -0,0 +1,401 @@
+from multiprocessing import get_context
+from contextlib import redirect_stdout
+from tempfile import mkdtemp
+import resource
+import random
+import shutil
+import json
+import time
+import csv
+import sys
+import os
+
+'''
+ --------------------------------------------------------------------------------
+ @What it does?
+    The following Python module is designed to measure the performance of the
+    preprocessing, querying, and feature extraction modules. It writes
+    deterministic synthetic inputs (CamFlow logs, CrossNamespaces JSON files,
+    and SPADE EFG exports), times the functions of every module on them and
+    reports the throughput and the peak memory for every input size.
+
+    Each benchmark runs in a fresh process. The input is generated first and
+    is not part of the timing. The peak memory is the resident set size
+    reached while the benchmarked function runs (on Linux the high water mark
+    is reset right before the run, elsewhere it includes the setup).
+
+ @When should you use it?
+    If you change one of the modules and wish to see whether it got slower or
+    how it scales with the size of its input then this Python module can help
+    you compare the numbers before and after the change.
+
+ @Benchmarks
+    sortlog             sortlog_camflow.readWriteLog on a CamFlow log
+    stream_entities     EFGquerygenerator_spade.streamEntities on a
+                        CrossNamespaces JSON file
+    query_generator     EFGquerygenerator_spade.main with base_template on a
+                        CrossNamespaces JSON file
+    build_constraint    EFGquerygenerator_spade.buildConstraint on a list of
+                        ids
+    privileged_docker   extract_privilegedflow.main with
+                        extract_priviledge_flow_docker on a list of EFGs
+    privileged_kube     extract_privilegedflow.main with
+                        extract_priviledge_flow_kubernetes on a list of EFGs
+
+ @Options
+    --sizes <N,...>         Number of records of every input (default
+                            1000,10000,100000,1000000).
+    --only <name,...>       Run only the given benchmarks.
+    --repeat <N>            Time every benchmark N times and keep the best.
+    --seed <N>              Seed of the synthetic inputs.
+    --disorder <N>          CamFlow logs: an edge is written up to N
+                            relation ids away from its sorted position.
+    --vertex-ratio <r>      CamFlow logs: share of the records that are
+                            vertices.
+    --readers <N>           CrossNamespaces JSON: readers of every entity.
+    --writers <N>           CrossNamespaces JSON: writers of every entity.
+    --efg-size <N>          EFGs: vertices and edges in every EFG file. The
+                            record count is split over size / N files.
+    --output <path>         Also write the results to a CSV file.
+
+ @authors
+    Shahpar Khan, Mashal Abbas
+ --------------------------------------------------------------------------------
+'''
+
+USAGE = "run python3 benchmark_paced.py [--sizes <N,...>] [--only <name,...>] [--repeat <N>] [--seed <N>] [--disorder <N>] [--vertex-ratio <r>] [--readers <N>] [--writers <N>] [--efg-size <N>] [--output <path>]"
+
+# Directories of the benchmarked modules
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODULE_PATHS = [os.path.join(REPOSITORY_PATH, "preprocessing", "python"), os.path.join(REPOSITORY_PATH, "querying", "python"), os.path.join(REPOSITORY_PATH, "feature_extraction", "python")]
+
+# Defaults of the synthetic inputs
+SIZES = [1000, 10000, 100000, 1000000]
+DISORDER = 50
+VERTEX_RATIO = 0.3
+READERS = 5
+WRITERS = 5
+EFG_SIZE = 1000
+
+# Namespaces used by the synthetic EFGs
+HOST_IPCNS = "4026531839"
+CLUSTER_IPCNS = "4026532455"
+POD_IPCNS = ["4026532601", "4026532602", "4026532603", "4026532604"]
+
+CSV_HEADER = ["benchmark", "records", "seconds", "records_per_second", "peak_mib"]
+
+
+# Function that writes a CamFlow log with vertex_count vertices and edge_count edges whose relation_ids are out of order by up to disorder
+def generateCamflowLog(log_path, vertex_count, edge_count, disorder, seed):
+
+    rng = random.Random(seed)
+
+    with open(log_path, "w") as f:
+        vertex_index = 0
+        edge_index = 0
+        while vertex_index < vertex_count or edge_index < edge_count:
+
+            if edge_index >= edge_count or (vertex_index < vertex_count and rng.random() < vertex_count / float(vertex_count + edge_count)):
+                obj = {"type": rng.choice(["Entity", "Activity"]), "id": "v" + str(vertex_index), "annotations": {"object_type": rng.choice(["file", "task", "process_memory", "path"]), "object_id": str(vertex_index), "boot_id": "1", "cf:machine_id": "cf:1", "jiffies": str(vertex_index)}}
+                vertex_index = vertex_index + 1
+            else:
+                relation_id = max(0, edge_index + rng.randint(-disorder, disorder))
+                from_id = "v" + str(rng.randint(0, max(0, vertex_count - 1)))
+                to_id = "v" + str(rng.randint(0, max(0, vertex_count - 1)))
+                obj = {"type": rng.choice(["Used", "WasGeneratedBy", "WasInformedBy"]), "id": "e" + str(edge_index), "from": from_id, "to": to_id, "annotations": {"relation_id": str(relation_id), "relation_type": rng.choice(["read", "write", "open"]), "from_type": "task", "jiffies": str(edge_index)}}
+                edge_index = edge_index + 1
+
+            f.write(json.dumps(obj) + "\n")
+
+
+# Function that writes a CrossNamespaces JSON file with one line per reader of every entity
+def generateCrossNamespaces(json_path, entity_count, readers, writers, seed):
+
+    rng = random.Random(seed)
+
+    with open(json_path, "w") as f:
+        for entity in range(entity_count):
+            artifact = {"boot_id": "b" + str(entity % 7), "cf:machine_id": "cf:m" + str(entity % 3), "object_id": "o" + str(entity), "object_type": "file"}
+            entity_writers = [{"id": "w" + str(entity) + "_" + str(w), "ipcns": rng.choice(POD_IPCNS)} for w in range(writers)]
+            for r in range(readers):
+                reader = {"id": "r" + str(entity) + "_" + str(r), "ipcns": rng.choice(POD_IPCNS)}
+                f.write(json.dumps({"artifact": artifact, "reader": reader, "writers": entity_writers}) + "\n")
+
+
+# Function that writes a SPADE EFG export of object_count vertices and edges centered on entity (boot_id, cf:machine_id, object_id)
+def generateEFG(efg_path, entity, object_count, seed):
+
+    rng = random.Random(seed)
+    boot_id, machine_id, object_id = entity
+
+    vertex_count = max(2, object_count // 3)
+    edge_count = max(1, object_count - vertex_count)
+
+    namespaces = [HOST_IPCNS, CLUSTER_IPCNS] + POD_IPCNS
+    objects = [{"type": "Entity", "id": "c" + object_id, "annotations": {"boot_id": boot_id, "cf:machine_id": machine_id, "object_id": object_id, "object_type": "file"}}]
+    for i in range(1, vertex_count):
+        objects.append({"type": "Activity", "id": "t" + object_id + "_" + str(i), "annotations": {"boot_id": boot_id, "cf:machine_id": machine_id, "object_id": str(i), "object_type": "process_memory", "ipcns": rng.choice(namespaces), "pidns": rng.choice(namespaces)}})
+
+    for i in range(edge_count):
+        task_id = objects[rng.randint(1, vertex_count - 1)]["id"]
+        if rng.random() < 0.5:
+            objects.append({"type": "Used", "from": task_id, "to": objects[0]["id"], "annotations": {"relation_type": "read", "from_type": "process_memory"}})
+        else:
+            objects.append({"type": "WasGeneratedBy", "from": objects[0]["id"], "to": task_id, "annotations": {"relation_type": "write", "from_type": "file"}})
+
+    with open(efg_path, "w") as f:
+        f.write("[\n" + "\n,".join(json.dumps(obj) for obj in objects) + "\n]\n")
+
+
+# Function that writes size / efg_size EFGs and the list file read by extract_privilegedflow.main
+#   The list holds bare file names since the center entity is read from the file name, main has to run inside directory
+def generateEFGList(directory, size, efg_size, seed):
+
+    list_path = os.path.join(directory, "efgs.txt")
+
+    with open(list_path, "w") as f:
+        for index in range(max(1, size // efg_size)):
+            entity = ("b" + str(index), "cf:m" + str(index), "o" + str(index))
+            efg_name = entity[0] + "_" + entity[1][3:] + "_" + entity[2] + "_" + str(index + 1) + "_graph.json"
+            generateEFG(os.path.join(directory, efg_name), entity, min(size, efg_size), seed + index)
+            f.write(efg_name + "\n")
+
+    return list_path
+
+
+# Function that resets the peak resident set size of this process; returns False where it is not supported
+def resetPeakMemory():
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# Function that returns the peak resident set size of this process in bytes
+def peakMemory():
+
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Functions that write the input of a benchmark into directory and return the function to time
+def setupSortlog(directory, size, settings):
+    import sortlog_camflow
+
+    log_path = os.path.join(directory, "camflow.json")
+    output_path = os.path.join(directory, "sorted.json")
+    vertex_count = int(size * settings["vertex_ratio"])
+    generateCamflowLog(log_path, vertex_count, size - vertex_count, settings["disorder"], settings["seed"])
+
+    return lambda: sortlog_camflow.readWriteLog([log_path], output_path)
+
+
+def setupStreamEntities(directory, size, settings):
+    import EFGquerygenerator_spade
+
+    json_path = os.path.join(directory, "crossnamespaces.json")
+    generateCrossNamespaces(json_path, max(1, size // settings["readers"]), settings["readers"], settings["writers"], settings["seed"])
+
+    return lambda: list(EFGquerygenerator_spade.streamEntities(json_path))
+
+
+def setupQueryGenerator(directory, size, settings):
+    import EFGquerygenerator_spade
+
+    json_path = os.path.join(directory, "crossnamespaces.json")
+    template_path = os.path.join(REPOSITORY_PATH, "querying", "python", "templates", "base_template")
+    output_path = os.path.join(directory, "queries")
+    generateCrossNamespaces(json_path, max(1, size // settings["readers"]), settings["readers"], settings["writers"], settings["seed"])
+
+    # The query file is appended to, so every run starts from an empty one
+    def run():
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        EFGquerygenerator_spade.main(json_path, template_path, output_path)
+
+    return run
+
+
+def setupBuildConstraint(directory, size, settings):
+    import EFGquerygenerator_spade
+
+    ids = [str(index) for index in range(size)]
+
+    return lambda: EFGquerygenerator_spade.buildConstraint(ids, "%reader_constraint")
+
+
+def setupPrivilegedDocker(directory, size, settings):
+    import extract_privilegedflow
+
+    list_path = generateEFGList(directory, size, settings["efg_size"], settings["seed"])
+    output_path = os.path.join(directory, "features.csv")
+    os.chdir(directory)
+
+    return lambda: extract_privilegedflow.main(list_path, extract_privilegedflow.extract_priviledge_flow_docker, HOST_IPCNS, output = output_path, use_cache = False)
+
+
+def setupPrivilegedKube(directory, size, settings):
+    import extract_privilegedflow
+
+    list_path = generateEFGList(directory, size, settings["efg_size"], settings["seed"])
+    output_path = os.path.join(directory, "features.csv")
+    os.chdir(directory)
+
+    return lambda: extract_privilegedflow.main(list_path, extract_privilegedflow.extract_priviledge_flow_kubernetes, HOST_IPCNS, CLUSTER_IPCNS, "1", output = output_path, use_cache = False)
+
+
+BENCHMARKS = {
+    "sortlog": setupSortlog,
+    "stream_entities": setupStreamEntities,
+    "query_generator": setupQueryGenerator,
+    "build_constraint": setupBuildConstraint,
+    "privileged_docker": setupPrivilegedDocker,
+    "privileged_kube": setupPrivilegedKube,
+}
+
+
+# Function run in a fresh process that sets up and times one benchmark; sends back (seconds, peak bytes) or an error message
+def runBenchmark(name, size, settings, connection):
+
+    directory = mkdtemp(prefix="paced_benchmark_")
+    try:
+        sys.path[0:0] = MODULE_PATHS
+        run = BENCHMARKS[name](directory, size, settings)
+
+        best = None
+        resetPeakMemory()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for _ in range(settings["repeat"]):
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+
+        connection.send((best, peakMemory(), None))
+    except Exception as e:
+        connection.send((None, None, type(e).__name__ + ": " + str(e)))
+    finally:
+        connection.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(sizes=SIZES, names=None, settings=None, output=None):
+
+    if names is None:
+        names = list(BENCHMARKS)
+    if settings is None:
+        settings = {"repeat": 1, "seed": 1, "disorder": DISORDER, "vertex_ratio": VERTEX_RATIO, "readers": READERS, "writers": WRITERS, "efg_size": EFG_SIZE}
+
+    # spawn gives every benchmark a clean interpreter so that peak memory is not inherited
+    context = get_context("spawn")
+
+    output_file = None
+    writer = None
+    if output is not None:
+        output_file = open(output, "w", newline="")
+        writer = csv.writer(output_file)
+        writer.writerow(CSV_HEADER)
+
+    print("%-18s %10s %10s %14s %10s" % ("Benchmark", "Records", "Seconds", "Records/s", "Peak MiB"))
+
+    for name in names:
+        for size in sizes:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=runBenchmark, args=(name, size, settings, sender))
+            process.start()
+            sender.close()
+            try:
+                seconds, peak, error = receiver.recv()
+            except EOFError:
+                seconds, peak, error = None, None, "process exited with code " + str(process.exitcode)
+            process.join()
+
+            if error is not None:
+                print("%-18s %10d  skipped: %s" % (name, size, error))
+                continue
+
+            throughput = size / seconds if seconds > 0 else float("inf")
+            print("%-18s %10d %10.3f %14.0f %10.1f" % (name, size, seconds, throughput, peak / 1048576.0))
+            if writer is not None:
+                writer.writerow([name, size, "%.6f" % seconds, "%.1f" % throughput, "%.1f" % (peak / 1048576.0)])
+                output_file.flush()
+
+    if output_file is not None:
+        output_file.close()
+
+
+# Function to separate '--option value' pairs into the arguments of main
+def parseArguments(argv):
+
+    sizes = SIZES
+    names = None
+    output = None
+    settings = {"repeat": 1, "seed": 1, "disorder": DISORDER, "vertex_ratio": VERTEX_RATIO, "readers": READERS, "writers": WRITERS, "efg_size": EFG_SIZE}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--sizes" and index + 1 < len(argv):
+            sizes = [int(size) for size in argv[index + 1].split(",")]
+            index = index + 2
+        elif argv[index] == "--only" and index + 1 < len(argv):
+            names = argv[index + 1].split(",")
+            for name in names:
+                if name not in BENCHMARKS:
+                    raise Exception("Unknown benchmark: " + name + "\nAvailable benchmarks: " + ",".join(BENCHMARKS))
+            index = index + 2
+        elif argv[index] == "--repeat" and index + 1 < len(argv):
+            settings["repeat"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--seed" and index + 1 < len(argv):
+            settings["seed"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--disorder" and index + 1 < len(argv):
+            settings["disorder"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--vertex-ratio" and index + 1 < len(argv):
+            settings["vertex_ratio"] = float(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--readers" and index + 1 < len(argv):
+            settings["readers"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--writers" and index + 1 < len(argv):
+            settings["writers"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--efg-size" and index + 1 < len(argv):
+            settings["efg_size"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--output" and index + 1 < len(argv):
+            output = argv[index + 1]
+            index = index + 2
+        else:
+            raise Exception(USAGE)
+
+    return sizes, names, settings, output
+
+
+if __name__ == '__main__':
+    try:
+        sizes, names, settings, output = parseArguments(sys.argv[1:])
+        print("Starting...")
+        print("Sizes:", ",".join(str(size) for size in sizes))
+        main(sizes, names, settings, output)
+
+    except KeyboardInterrupt:
+        print("Exiting...")
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
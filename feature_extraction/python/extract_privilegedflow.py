@@ -1,8 +1,18 @@
-import pandas as pd
+from multiprocessing import Pool
+from array import array
+import hashlib
+import struct
+import mmap
 import json
+import csv
 import sys
 import os
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 '''
  --------------------------------------------------------------------------------
  @What it does?
@@ -19,6 +29,40 @@ import os
     of privileged flows, we define the following two policies:
         • Policy 1: Ban low to critical level flows and inter pod flows
         • Policy 2: Ban only low to critical level flows
+
+@Feature engine
+    The 'all' mode loads every EFG once and evaluates a set of features on it,
+    writing one column per feature (see FEATURE_FUNCTIONS). By default all
+    features are computed; a comma separated list selects a subset.
+
+@Dataset mode
+    The 'dataset' mode loads all EFGs of the file list into one vertex table
+    and one edge table whose rows are tagged with the index of their graph.
+    Namespaces are coded as integers and the Docker and both Kubernetes
+    privileged flow flags of every graph are computed at once with NumPy
+    array operations instead of a Python loop per graph. Needs numpy; only
+    --output applies to this mode.
+
+@Options
+    --jobs <N>  Process the EFGs in N worker processes. Rows are written in
+                the order of the input file list. A file that fails to load
+                is reported and skipped without stopping the batch.
+    --output <path>
+                CSV file the rows are streamed to (default features.csv).
+    --cache <path>
+                Result cache keyed by file path, size, modification time,
+                IPCNS configuration and policy (default <output>.cache).
+                Files whose key is already cached are not processed again,
+                so a rerun picks up where a crashed run stopped.
+    --no-cache  Process every file and do not write a cache.
+    --graph-cache <dir>
+                Keep a binary copy of every parsed EFG in <dir>. Strings are
+                interned into a table and vertices and edges are stored as
+                integer columns. The next run memory-maps the copy instead
+                of parsing the JSON again and selects the center entity,
+                its readers and its writers on the columns with NumPy, so
+                only their strings are decoded. A copy is rebuilt when its
+                JSON file changes size or modification time. Needs numpy.
  
  @authors 
     Shahpar Khan, Mashal Abbas
@@ -26,42 +70,160 @@ import os
 '''
 
 # Global variables
-EDGES = []
-VERTICES = []
 HEADER = ["bID_mID_oID", "priviledged_flow"]
-FEATURES = pd.DataFrame(columns=HEADER)
+OUTPUT_PATH = "features.csv"
 ENTITY_COUNTS = {}
 '''
 HEADER:
     priviledged_flow    : (binary) 1 if there is a flow from low host to container; 0 otherwise.
 
+FEATURE_FUNCTIONS (columns of the 'all' mode):
+    priviledged_flow_docker     : priviledged_flow under Docker.
+    priviledged_flow_policy_1   : priviledged_flow under Kubernetes policy 1.
+    priviledged_flow_policy_2   : priviledged_flow under Kubernetes policy 2.
+    reader_count                : number of distinct processes reading the center entity.
+    writer_count                : number of distinct processes writing the center entity.
+    reader_ipcns_count          : number of distinct IPC namespaces reading the center entity (fan-out).
+    writer_ipcns_count          : number of distinct IPC namespaces writing the center entity (fan-in).
+    pod_count                   : number of distinct pods, i.e. (ipcns, pidns) outside the host and the cluster, among readers and writers.
+
     * center entity is the object on which the crossnamespace event is happening. There is only one center entity per json file.
 '''
-CENTER_ENTITY = None
 HOST_IPCNS = None
 CLUSTER_IPCNS = None
 POLICY_NUMBER = None
-
-
-def set_center_entity(filepath):
-    global VERTICES, CENTER_ENTITY
+# Annotations kept while reading an EFG, all others (argv, path, jiffies, ...) are dropped right away
+KEPT_ANNOTATIONS = {"ipcns", "pidns", "boot_id", "cf:machine_id", "object_id", "from_type"}
+READ_SIZE = 65536
+# Largest object read_objects buffers before it gives up on decoding it
+MAX_OBJECT_SIZE = 64 * 1024 * 1024
+# Layout of a graph cache file: header, string table, vertex columns, edge columns
+#   header : magic, size and mtime_ns of the JSON file, string table bytes, vertex count, edge count
+#   strings: every string followed by a zero byte, coded by its index (-1 is None)
+GRAPH_CACHE_MAGIC = b"EFGCACH2"
+GRAPH_CACHE_HEADER = struct.Struct("<8sqqqqq")
+VERTEX_COLUMNS = 6
+EDGE_COLUMNS = 3
+# Edge types kept by the dataset mode and the columns it writes
+DATASET_EDGE_TYPES = {"Used": 0, "WasGeneratedBy": 1}
+DATASET_FEATURES = ["priviledged_flow_docker", "priviledged_flow_policy_1", "priviledged_flow_policy_2"]
+
+
+# Class that keeps only the vertex fields used by the features
+class Vertex:
+    __slots__ = ("id", "ipcns", "pidns", "boot_id", "machine_id", "object_id")
+
+    def __init__(self, id, ipcns, pidns, boot_id, machine_id, object_id):
+        # Namespaces and ids repeat across vertices so only one copy of each string is kept
+        self.id = sys.intern(id)
+        self.ipcns = intern_value(ipcns)
+        self.pidns = intern_value(pidns)
+        self.boot_id = intern_value(boot_id)
+        self.machine_id = intern_value(machine_id)
+        self.object_id = object_id
+
+    @staticmethod
+    def from_object(obj):
+        annotations = obj["annotations"]
+
+        return Vertex(obj["id"], annotations.get("ipcns"), annotations.get("pidns"), annotations.get("boot_id"), annotations.get("cf:machine_id"), annotations.get("object_id"))
+
+
+# Class for one entity flow graph. Edges are only kept as the adjacency index
+#   vertex_by_id     : id -> Vertex
+#   vertex_by_entity : (boot_id, cf:machine_id, object_id) -> Vertex
+#   in_edges         : id -> {edge type -> [ids of the 'from' vertices]}
+#   out_edges        : id -> {edge type -> [ids of the 'to' vertices]}
+class EFG:
+    __slots__ = ("vertex_by_id", "vertex_by_entity", "in_edges", "out_edges", "center_entity", "reader_vertices", "writer_vertices")
+
+    def __init__(self):
+        self.vertex_by_id = {}
+        self.vertex_by_entity = {}
+        self.in_edges = {}
+        self.out_edges = {}
+        self.center_entity = None
+        self.reader_vertices = None
+        self.writer_vertices = None
+
+    def add_vertex(self, obj):
+        self.put_vertex(Vertex.from_object(obj))
+
+    def put_vertex(self, v):
+        self.vertex_by_id[v.id] = v
+        if v.boot_id is not None and v.machine_id is not None and v.object_id is not None:
+            self.vertex_by_entity[(v.boot_id, v.machine_id, v.object_id)] = v
+
+    def add_edge(self, obj):
+        self.put_edge(obj["type"], obj["from"], obj["to"])
+
+    def put_edge(self, edge_type, from_id, to_id):
+        edge_type = sys.intern(edge_type)
+        from_id = sys.intern(from_id)
+        to_id = sys.intern(to_id)
+        self.in_edges.setdefault(to_id, {}).setdefault(edge_type, []).append(from_id)
+        self.out_edges.setdefault(from_id, {}).setdefault(edge_type, []).append(to_id)
+
+    # Function that yields every edge as (edge type, from id, to id)
+    def edges(self):
+        for (from_id, edges_by_type) in self.out_edges.items():
+            for (edge_type, to_ids) in edges_by_type.items():
+                for to_id in to_ids:
+                    yield (edge_type, from_id, to_id)
+
+    # Function to return the vertices connected to the center entity by edges of a given type
+    def neighbours(self, adjacency, edge_type):
+        neighbour_ids = adjacency.get(self.center_entity.id, {}).get(edge_type, [])
+
+        return [self.vertex_by_id[id] for id in neighbour_ids if id in self.vertex_by_id]
+
+    # Processes reading the center entity - type == Used
+    def readers(self):
+        if self.reader_vertices is None:
+            self.reader_vertices = self.neighbours(self.in_edges, "Used")
+
+        return self.reader_vertices
+
+    # Processes writing the center entity - type == WasGeneratedBy
+    def writers(self):
+        if self.writer_vertices is None:
+            self.writer_vertices = self.neighbours(self.out_edges, "WasGeneratedBy")
+
+        return self.writer_vertices
+
+
+# Function to return a value as an interned string --- None if it is missing
+def intern_value(value):
+
+    return None if value is None else sys.intern(value)
+
+
+# Function to return the (boot_id, cf:machine_id, object_id) of the center entity named by the file
+def center_entity_key(filepath):
 
     ids = filepath.split(".")[0].split("_")[:-1]
     ids[1] = "cf:" + ids[1]
 
-    # updating center entity globally
-    for v in VERTICES:
-        if v["annotations"]["boot_id"] == ids[0] and v["annotations"]["cf:machine_id"] == ids[1] and v["annotations"]["object_id"] == ids[2]:
-            CENTER_ENTITY = v
+    return (ids[0], ids[1], ids[2])
+
+
+def set_center_entity(efg, filepath):
 
+    efg.center_entity = efg.vertex_by_entity.get(center_entity_key(filepath))
+    efg.reader_vertices = None
+    efg.writer_vertices = None
 
-# Function to extract priviledged_flow for kubernetes environment
-def extract_priviledge_flow_kubernetes():
-    global VERTICES, EDGES, CENTER_ENTITY, HOST_IPCNS, CLUSTER_IPCNS, POLICY_NUMBER
+
+# Function to extract priviledged_flow for kubernetes environment, under POLICY_NUMBER unless a policy is given
+def extract_priviledge_flow_kubernetes(efg, policy = None):
+    global HOST_IPCNS, CLUSTER_IPCNS, POLICY_NUMBER
 
     check_inter_pod_flows = False
 
-    if POLICY_NUMBER == "1":
+    if policy is None:
+        policy = POLICY_NUMBER
+
+    if policy == "1":
         print("Checking for inter pod flows...")
         check_inter_pod_flows = True
 
@@ -71,39 +233,13 @@ def extract_priviledge_flow_kubernetes():
     reader_ipc_pid_ns = set()
     writer_ipc_pid_ns = set()
 
-    # Getting ids of reading processes - type == Used
-    ids_from_type_used = []
-    # Getting ids of writing processes - type == WasGeneratedBy
-    ids_to_type_WGB = []
-
-    for e in EDGES:
-        # conditions
-        to_center_entity = e["to"] == CENTER_ENTITY["id"]
-
-        edge_type_used = e["type"] == "Used"
-
-        if to_center_entity and edge_type_used:
-            ids_from_type_used.append(e["from"])
-
-        from_center_entity = e["from"] == CENTER_ENTITY["id"]
-
-        edge_type_WGB = e["type"] == "WasGeneratedBy"
+    for v in efg.readers():
+        reader_ipc_pid_ns.add((v.ipcns, v.pidns))
+        reader_ns[0].add(v.ipcns)
 
-        if from_center_entity and edge_type_WGB:
-            ids_to_type_WGB.append(e["to"])
-
-    for v in VERTICES:
-        for id in ids_from_type_used:
-            if (v['id'] == id):
-                r_ns = (v['annotations']['ipcns'],)
-                reader_ipc_pid_ns.add((v['annotations']['ipcns'], v['annotations']['pidns']))
-                reader_ns[0].add(r_ns[0])
-
-        for id in ids_to_type_WGB:
-            if (v['id'] == id):
-                w_ns = (v['annotations']['ipcns'],)
-                writer_ipc_pid_ns.add((v['annotations']['ipcns'], v['annotations']['pidns']))
-                writer_ns[0].add(w_ns[0])
+    for v in efg.writers():
+        writer_ipc_pid_ns.add((v.ipcns, v.pidns))
+        writer_ns[0].add(v.ipcns)
 
 
     priviledged_flow = 0
@@ -171,46 +307,18 @@ def extract_priviledge_flow_kubernetes():
 
 
 # Function to extract priviledged_flow for docker environment
-def extract_priviledge_flow_docker():
-    global VERTICES, EDGES, CENTER_ENTITY, HOST_IPCNS
+def extract_priviledge_flow_docker(efg):
+    global HOST_IPCNS
 
     #contains a list of the tuples of namespaces
     reader_ns = (set(), set(), set(), set(), set())
     writer_ns = (set(), set(), set(), set(), set())
 
-    # Getting ids of reading processes - type == Used
-    ids_from_type_used = []
-    # Getting ids of writing processes - type == WasGeneratedBy
-    ids_to_type_WGB = []
-
-    for e in EDGES:
-        # conditions
-        to_center_entity = e["to"] == CENTER_ENTITY["id"]
-
-        edge_type_used = e["type"] == "Used"
-
-        if to_center_entity and edge_type_used:
-            ids_from_type_used.append(e["from"])
-
-        from_center_entity = e["from"] == CENTER_ENTITY["id"]
-
-        edge_type_WGB = e["type"] == "WasGeneratedBy"
+    for v in efg.readers():
+        reader_ns[0].add(v.ipcns)
 
-        if from_center_entity and edge_type_WGB:
-            ids_to_type_WGB.append(e["to"])
-
-    for v in VERTICES:
-        for id in ids_from_type_used:
-            if (v['id'] == id):
-                r_ns = (v['annotations']['ipcns'],)
-
-                reader_ns[0].add(r_ns[0])
-
-        for id in ids_to_type_WGB:
-            if (v['id'] == id):
-                w_ns = (v['annotations']['ipcns'],)
-
-                writer_ns[0].add(w_ns[0])
+    for v in efg.writers():
+        writer_ns[0].add(v.ipcns)
 
     check_writer_container = False
     check_reader_host = False
@@ -232,94 +340,635 @@ def extract_priviledge_flow_docker():
     return priviledged_flow
 
 
-# Function to load a graph in a JSON format and store its vertices and edges globally
-def load_data(filepath):
-    global EDGES, VERTICES
-    
+# Function that yields the objects of a SPADE JSON export one at a time, keeping only the given annotations
+#   The export is read in chunks and decoded object by object, so the layout of the lines does not matter
+#   and only the current object is held in memory
+def read_objects(filepath, kept_annotations = KEPT_ANNOTATIONS):
+    decoder = json.JSONDecoder()
+    separators = " \t\r\n,[]"
+
     with open(filepath, "r") as f:
-        for line in f:
-            if "[" in line or "]" in line:
-                continue
+        buffer = ""
+        position = 0
+        end_of_file = False
 
-            if line[0] == ",":
-                obj = json.loads(line[1:])
-            else:
-                obj = json.loads(line)
+        while True:
+            while position < len(buffer) and buffer[position] in separators:
+                position = position + 1
+
+            if position < len(buffer):
+                try:
+                    (obj, position) = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    # The object is cut by the end of the chunk only if the token it fails on runs to the end of the
+                    #   buffer, tokens never hold a newline so one after the failure means the object is malformed
+                    if end_of_file or buffer.find("\n", e.pos) != -1 or len(buffer) - position > MAX_OBJECT_SIZE:
+                        raise
+                    obj = None
+
+                if obj is not None:
+                    annotations = obj.get("annotations", {})
+                    obj["annotations"] = {key: annotations[key] for key in kept_annotations if key in annotations}
+                    yield obj
+                    continue
+
+            elif end_of_file:
+                return
+
+            chunk = f.read(READ_SIZE)
+            end_of_file = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def extract_priviledge_flow_policy_1(efg):
+    return extract_priviledge_flow_kubernetes(efg, "1")
+
+
+def extract_priviledge_flow_policy_2(efg):
+    return extract_priviledge_flow_kubernetes(efg, "2")
+
+
+def extract_reader_count(efg):
+    return len({v.id for v in efg.readers()})
 
-            if "from_type" in obj["annotations"]:
-                EDGES.append(obj)
-            else:
-                VERTICES.append(obj)
+
+def extract_writer_count(efg):
+    return len({v.id for v in efg.writers()})
+
+
+def extract_reader_ipcns_count(efg):
+    return len({v.ipcns for v in efg.readers()})
+
+
+def extract_writer_ipcns_count(efg):
+    return len({v.ipcns for v in efg.writers()})
+
+
+def extract_pod_count(efg):
+    global HOST_IPCNS, CLUSTER_IPCNS
+
+    pods = {(v.ipcns, v.pidns) for v in efg.readers() + efg.writers()}
+
+    return len([pod for pod in pods if pod[0] != HOST_IPCNS and pod[0] != CLUSTER_IPCNS])
+
+
+FEATURE_FUNCTIONS = {
+    "priviledged_flow_docker": extract_priviledge_flow_docker,
+    "priviledged_flow_policy_1": extract_priviledge_flow_policy_1,
+    "priviledged_flow_policy_2": extract_priviledge_flow_policy_2,
+    "reader_count": extract_reader_count,
+    "writer_count": extract_writer_count,
+    "reader_ipcns_count": extract_reader_ipcns_count,
+    "writer_ipcns_count": extract_writer_ipcns_count,
+    "pod_count": extract_pod_count,
+}
+
+
+# Function to load a graph in a JSON format into a new EFG
+def load_data(filepath):
+    efg = EFG()
+
+    for obj in read_objects(filepath):
+        if "from_type" in obj["annotations"]:
+            efg.add_edge(obj)
+        else:
+            efg.add_vertex(obj)
+
+    return efg
+
+
+# Function that returns the path of the graph cache file of a JSON file
+def graph_cache_path(graph_cache, filepath):
+
+    return os.path.join(graph_cache, hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest() + ".efgc")
+
+
+# Function to write an EFG to a graph cache file
+def write_graph_cache(efg, cache_path, source_stat):
+    codes = {None: -1}
+    strings = []
+
+    def code(value):
+        if value not in codes:
+            codes[value] = len(strings)
+            strings.append(value)
+        return codes[value]
+
+    # The vertices that own an entity key go last so that loading them again picks the same center entity candidates
+    entity_vertices = list(efg.vertex_by_entity.values())
+    owners = {id(v) for v in entity_vertices}
+    vertices = [v for v in efg.vertex_by_id.values() if id(v) not in owners] + entity_vertices
+
+    vertex_columns = [array('i') for _ in range(VERTEX_COLUMNS)]
+    for v in vertices:
+        for (column, value) in zip(vertex_columns, (v.id, v.ipcns, v.pidns, v.boot_id, v.machine_id, v.object_id)):
+            column.append(code(value))
+
+    edge_columns = [array('i') for _ in range(EDGE_COLUMNS)]
+    for edge in efg.edges():
+        for (column, value) in zip(edge_columns, edge):
+            column.append(code(value))
+
+    string_table = "".join(string + "\0" for string in strings).encode()
+    string_table = string_table + b"\0" * (-len(string_table) % 4)
+
+    temporary_path = cache_path + "." + str(os.getpid())
+    with open(temporary_path, "wb") as f:
+        f.write(GRAPH_CACHE_HEADER.pack(GRAPH_CACHE_MAGIC, source_stat.st_size, source_stat.st_mtime_ns, len(string_table), len(vertices), len(edge_columns[0])))
+        f.write(string_table)
+        for column in vertex_columns + edge_columns:
+            f.write(column.tobytes())
+
+    os.replace(temporary_path, cache_path)
+
+
+# Function to read the center entity, its readers, its writers and their edges from a graph cache file --- None if there is no valid cache for the JSON file
+#   The rows are selected with NumPy on the mapped columns and only the strings of the selected vertices are decoded,
+#   the other vertices and edges never become Python objects
+def read_graph_cache(cache_path, source_stat, entity):
+    if not os.path.exists(cache_path) or os.path.getsize(cache_path) < GRAPH_CACHE_HEADER.size:
+        return None
+
+    # The map is closed when the arrays over it are dropped
+    with open(cache_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, size, mtime_ns, string_bytes, vertex_count, edge_count) = GRAPH_CACHE_HEADER.unpack_from(data)
+    if magic != GRAPH_CACHE_MAGIC or size != source_stat.st_size or mtime_ns != source_stat.st_mtime_ns:
+        return None
+
+    offset = GRAPH_CACHE_HEADER.size
+    # Every string ends with a zero byte, so string k ends at the k-th zero byte of the table
+    string_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8, count=string_bytes, offset=offset) == 0)
+    integers = np.frombuffer(data, dtype=np.int32, count=VERTEX_COLUMNS * vertex_count + EDGE_COLUMNS * edge_count, offset=offset + string_bytes)
+    vertices = integers[:VERTEX_COLUMNS * vertex_count].reshape(VERTEX_COLUMNS, vertex_count)
+    edges = integers[VERTEX_COLUMNS * vertex_count:].reshape(EDGE_COLUMNS, edge_count)
+
+    # Function to look up the code of a string in the table --- -2 (matches nothing, None is -1) if it is missing
+    def code(value):
+        encoded = value.encode() + b"\0"
+        if data[offset:offset + len(encoded)] == encoded:
+            return 0
+        position = data.find(b"\0" + encoded, offset, offset + string_bytes)
+        if position < 0:
+            return -2
+        return int(np.searchsorted(string_ends, position - offset)) + 1
+
+    # Function to decode the given codes --- returns code -> string
+    def decode(codes):
+        codes = np.unique(codes)
+        codes = codes[codes >= 0]
+        starts = np.where(codes > 0, string_ends[codes - 1] + 1, 0) + offset
+        ends = string_ends[codes] + offset
+        strings = {-1: None}
+        for (code, start, end) in zip(codes.tolist(), starts.tolist(), ends.tolist()):
+            strings[code] = sys.intern(data[start:end].decode())
+        return strings
+
+    efg = EFG()
+
+    # As in EFG.put_vertex, an entity belongs to its last vertex
+    entity_codes = [code(value) for value in entity]
+    center_rows = np.flatnonzero((vertices[3] == entity_codes[0]) & (vertices[4] == entity_codes[1]) & (vertices[5] == entity_codes[2]))
+    if len(center_rows) == 0:
+        return efg
+    center_row = int(center_rows[-1])
+    center_id = vertices[0, center_row]
+
+    # Readers: 'from' of Used edges into the center; writers: 'to' of WasGeneratedBy edges out of the center
+    #   the features only look at distinct readers and writers, so every one of them is kept once
+    reader_ids = np.unique(edges[1][(edges[0] == code("Used")) & (edges[2] == center_id)])
+    writer_ids = np.unique(edges[2][(edges[0] == code("WasGeneratedBy")) & (edges[1] == center_id)])
+
+    # Only the id and the namespaces of a reader or writer are decoded, as in EFG.put_vertex an id belongs to its last vertex
+    rows = np.flatnonzero(np.isin(vertices[0], np.concatenate((reader_ids, writer_ids))))
+    strings = decode(np.concatenate((vertices[:3, rows].ravel(), vertices[:, center_row])))
+    for (id, ipcns, pidns) in zip(*vertices[:3, rows].tolist()):
+        efg.vertex_by_id[strings[id]] = Vertex(strings[id], strings[ipcns], strings[pidns], None, None, None)
+    efg.put_vertex(Vertex(*[strings[value] for value in vertices[:, center_row].tolist()]))
+
+    center_id = strings[int(center_id)]
+    efg.in_edges[center_id] = {"Used": [strings[id] for id in reader_ids.tolist() if id in strings]}
+    efg.out_edges[center_id] = {"WasGeneratedBy": [strings[id] for id in writer_ids.tolist() if id in strings]}
+
+    return efg
+
+
+# Function to load a graph through the graph cache when one is given
+def load_graph(filepath, graph_cache = None):
+    if graph_cache is None:
+        return load_data(filepath)
+
+    source_stat = os.stat(filepath)
+    cache_path = graph_cache_path(graph_cache, filepath)
+
+    efg = read_graph_cache(cache_path, source_stat, center_entity_key(filepath))
+    if efg is None:
+        efg = load_data(filepath)
+        os.makedirs(graph_cache, exist_ok=True)
+        write_graph_cache(efg, cache_path, source_stat)
+
+    return efg
 
 
 # Function to extract the identifier <boot_id>_<cf:machine_id>_<object_id>
-def extract_identifier():
-    global CENTER_ENTITY
+def extract_identifier(efg):
+
+    return efg.center_entity.boot_id + "_" + efg.center_entity.machine_id.split(":")[1] + "_" + efg.center_entity.object_id
+
+
+# Class for many EFGs in columnar tables, every row is tagged with the index of its graph
+#   vertex_graph, vertex_ipcns, vertex_pidns : one row per vertex, namespaces coded through namespace_codes
+#   edge_graph, edge_type, edge_from, edge_to : one row per Used or WasGeneratedBy edge, ends are vertex rows (-1 if missing)
+#   centers, identifiers                      : vertex row and bID_mID_oID of the center entity of every graph
+class Dataset:
+    __slots__ = ("namespace_codes", "vertex_graph", "vertex_ipcns", "vertex_pidns", "edge_graph", "edge_type", "edge_from", "edge_to", "centers", "identifiers")
+
+    def __init__(self):
+        self.namespace_codes = {}
+        self.vertex_graph = array("q")
+        self.vertex_ipcns = array("q")
+        self.vertex_pidns = array("q")
+        self.edge_graph = array("q")
+        self.edge_type = array("q")
+        self.edge_from = array("q")
+        self.edge_to = array("q")
+        self.centers = array("q")
+        self.identifiers = []
+
+    # A missing namespace gets a code of its own like any other value
+    def code(self, namespace):
+        code = self.namespace_codes.get(namespace)
+        if code is None:
+            code = len(self.namespace_codes)
+            self.namespace_codes[namespace] = code
+
+        return code
+
+    # Function to append one JSON file as the next graph; the tables are left untouched if it fails
+    def add_graph(self, filepath):
+        graph = len(self.centers)
+        first_row = len(self.vertex_graph)
+
+        ipcns = []
+        pidns = []
+        row_by_id = {}
+        entity_ids = {}
+        edges = []
+
+        for obj in read_objects(filepath):
+            annotations = obj["annotations"]
+            if "from_type" in annotations:
+                if obj["type"] in DATASET_EDGE_TYPES:
+                    edges.append((DATASET_EDGE_TYPES[obj["type"]], obj["from"], obj["to"]))
+            else:
+                # As in EFG, a repeated id or entity points to its last vertex
+                row_by_id[obj["id"]] = first_row + len(ipcns)
+                entity = (annotations.get("boot_id"), annotations.get("cf:machine_id"), annotations.get("object_id"))
+                if None not in entity:
+                    entity_ids[entity] = obj["id"]
+                ipcns.append(self.code(annotations.get("ipcns")))
+                pidns.append(self.code(annotations.get("pidns")))
+
+        entity = center_entity_key(filepath)
+        if entity not in entity_ids:
+            raise ValueError("Center entity not found in the graph")
+
+        self.vertex_graph.extend([graph] * len(ipcns))
+        self.vertex_ipcns.extend(ipcns)
+        self.vertex_pidns.extend(pidns)
+        for (edge_type, from_id, to_id) in edges:
+            self.edge_graph.append(graph)
+            self.edge_type.append(edge_type)
+            self.edge_from.append(row_by_id.get(from_id, -1))
+            self.edge_to.append(row_by_id.get(to_id, -1))
+        self.centers.append(row_by_id[entity_ids[entity]])
+        self.identifiers.append(entity[0] + "_" + entity[1].split(":")[1] + "_" + entity[2])
+
+    # Function to return every column as a NumPy array
+    def columns(self):
+        return {name: np.frombuffer(getattr(self, name), dtype=np.int64) for name in ("vertex_ipcns", "vertex_pidns", "edge_graph", "edge_type", "edge_from", "edge_to", "centers")}
+
+
+# Function to compute DATASET_FEATURES of every graph of a Dataset at once, returns one 0/1 array per feature
+def extract_dataset_features(dataset):
+    global HOST_IPCNS, CLUSTER_IPCNS
+
+    tables = dataset.columns()
+    graph_count = len(dataset.centers)
+    namespace_count = max(len(dataset.namespace_codes), 1)
+
+    # Namespaces that never occur get a code that matches nothing
+    host = dataset.namespace_codes.get(HOST_IPCNS, -1)
+    cluster = dataset.namespace_codes.get(CLUSTER_IPCNS, -1)
+
+    edge_graph = tables["edge_graph"]
+    center = tables["centers"][edge_graph]
+
+    # Readers: 'from' of Used edges into the center; writers: 'to' of WasGeneratedBy edges out of the center
+    reading = (tables["edge_type"] == DATASET_EDGE_TYPES["Used"]) & (tables["edge_to"] == center) & (tables["edge_from"] >= 0)
+    writing = (tables["edge_type"] == DATASET_EDGE_TYPES["WasGeneratedBy"]) & (tables["edge_from"] == center) & (tables["edge_to"] >= 0)
+
+    reader_graph = edge_graph[reading]
+    reader_ipcns = tables["vertex_ipcns"][tables["edge_from"][reading]]
+    reader_pidns = tables["vertex_pidns"][tables["edge_from"][reading]]
+    writer_graph = edge_graph[writing]
+    writer_ipcns = tables["vertex_ipcns"][tables["edge_to"][writing]]
+    writer_pidns = tables["vertex_pidns"][tables["edge_to"][writing]]
+
+    # Function to flag the graphs having at least one row where the condition holds
+    def any_by_graph(graph_column, condition):
+        flags = np.zeros(graph_count, dtype=bool)
+        flags[graph_column[condition]] = True
+        return flags
+
+    reader_pod = (reader_ipcns != host) & (reader_ipcns != cluster)
+    writer_pod = (writer_ipcns != host) & (writer_ipcns != cluster)
+
+    read_from_vm = any_by_graph(reader_graph, reader_ipcns == host)
+    read_from_cluster = any_by_graph(reader_graph, reader_ipcns == cluster)
+    write_from_cluster = any_by_graph(writer_graph, writer_ipcns == cluster)
+    write_from_pod = any_by_graph(writer_graph, writer_pod)
+    write_from_container = any_by_graph(writer_graph, writer_ipcns != host)
+
+    docker = read_from_vm & write_from_container
+    policy_2 = (write_from_cluster & read_from_vm) | (write_from_pod & read_from_vm) | (write_from_pod & read_from_cluster)
+
+    # Inter pod flows: a reader pod (ipcns, pidns) that is not a writer pod of the same graph
+    reader_pods = (reader_graph[reader_pod] * namespace_count + reader_ipcns[reader_pod]) * namespace_count + reader_pidns[reader_pod]
+    writer_pods = (writer_graph[writer_pod] * namespace_count + writer_ipcns[writer_pod]) * namespace_count + writer_pidns[writer_pod]
+    inter_pod = any_by_graph(reader_graph[reader_pod], ~np.isin(reader_pods, writer_pods))
+
+    policy_1 = policy_2 | (write_from_pod & inter_pod)
+
+    return {"priviledged_flow_docker": docker.astype(np.int64), "priviledged_flow_policy_1": policy_1.astype(np.int64), "priviledged_flow_policy_2": policy_2.astype(np.int64)}
+
+
+# Class that remembers the data point of every processed file in an append-only JSON lines file
+class ResultCache:
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.results = {}
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.results[entry["key"]] = entry["data_point"]
+                    except Exception:
+                        # A line cut short by a crash is simply recomputed
+                        continue
+
+        self.cache_file = open(cache_path, "a")
+
+    # Function to build the key of a file: any change to the file, the features or the configuration misses the cache
+    @staticmethod
+    def key(file, columns):
+        stat = os.stat(file)
+        features = [column + ":" + function.__name__ for (column, function) in columns]
+
+        return json.dumps([os.path.abspath(file), stat.st_size, stat.st_mtime_ns, features, HOST_IPCNS, CLUSTER_IPCNS, POLICY_NUMBER])
+
+    def get(self, key):
+        return self.results.get(key)
+
+    def put(self, key, data_point):
+        self.results[key] = data_point
+        self.cache_file.write(json.dumps({"key": key, "data_point": data_point}) + "\n")
+        self.cache_file.flush()
 
-    return CENTER_ENTITY["annotations"]["boot_id"] + "_" + CENTER_ENTITY["annotations"]["cf:machine_id"].split(":")[1] + "_" + CENTER_ENTITY["annotations"]["object_id"]
+    def close(self):
+        self.cache_file.close()
 
 
-def main(filepath, extract_priviledge_flow, host_ipcns, cluster_ipcns = None, policy = None):
-    global EDGES, VERTICES, FEATURES, HOST_IPCNS, CLUSTER_IPCNS, POLICY_NUMBER
+# Function to set the namespace configuration, also used to initialize every worker process
+def set_configuration(host_ipcns, cluster_ipcns = None, policy = None):
+    global HOST_IPCNS, CLUSTER_IPCNS, POLICY_NUMBER
 
     HOST_IPCNS = host_ipcns
     CLUSTER_IPCNS = cluster_ipcns
     POLICY_NUMBER = policy
 
+
+# Function to compute the data point of a single JSON file --- returns (file, data_point, error)
+#   columns is a list of (column name, feature function), all evaluated on the same loaded graph
+def process_file(task):
+    (file, columns, graph_cache) = task
+
+    try:
+        efg = load_graph(file, graph_cache)
+
+        set_center_entity(efg, file)
+        if efg.center_entity is None:
+            raise ValueError("Center entity not found in the graph")
+
+        data_point = {HEADER[0]: extract_identifier(efg)}
+        for (column, extract_feature) in columns:
+            data_point[column] = extract_feature(efg)
+
+    except Exception as e:
+        return file, None, repr(e)
+
+    return file, data_point, None
+
+
+# Main function: extract_priviledge_flow gives the single 'priviledged_flow' column, feature_names (from FEATURE_FUNCTIONS) replaces it with one column per feature
+def main(filepath, extract_priviledge_flow, host_ipcns, cluster_ipcns = None, policy = None, jobs = 1, output = OUTPUT_PATH, cache = None, use_cache = True, feature_names = None, graph_cache = None):
+
+    if graph_cache is not None and np is None:
+        raise Exception("The graph cache needs numpy")
+
+    set_configuration(host_ipcns, cluster_ipcns, policy)
+
+    if feature_names is None:
+        columns = [(HEADER[1], extract_priviledge_flow)]
+    else:
+        columns = [(name, FEATURE_FUNCTIONS[name]) for name in feature_names]
+
     files = []
 
     with open(filepath, "r") as f:
-        files = f.readlines()
+        files = [line.strip() for line in f if line.strip()]
+
+    result_cache = None
+    if use_cache:
+        result_cache = ResultCache(cache if cache is not None else output + ".cache")
+
+    # Looking up the files that were already processed with the same configuration
+    keys = {}
+    cached = {}
+    if result_cache is not None:
+        for file in files:
+            try:
+                keys[file] = ResultCache.key(file, columns)
+            except OSError:
+                continue
+            if result_cache.get(keys[file]) is not None:
+                cached[file] = result_cache.get(keys[file])
 
-    counter = 1
-    for file in files:
-        load_data(file.strip())
+    tasks = [(file, columns, graph_cache) for file in files if file not in cached]
 
-        set_center_entity(file.strip())
+    if jobs > 1:
+        pool = Pool(jobs, initializer=set_configuration, initargs=(host_ipcns, cluster_ipcns, policy))
+        # imap hands back the results in the order of the file list
+        results = pool.imap(process_file, tasks, chunksize=16)
+    else:
+        pool = None
+        results = map(process_file, tasks)
 
+    output_file = open(output, "w", newline="")
+    writer = csv.DictWriter(output_file, fieldnames=[HEADER[0]] + [column for (column, _) in columns])
+    writer.writeheader()
 
-        
-        priviledged_flow = extract_priviledge_flow()
-        bID_mID_oID = extract_identifier()
+    counter = 1
+    for file in files:
+        if file in cached:
+            data_point = cached[file]
+            error = None
+        else:
+            (_, data_point, error) = next(results)
+            if error is None and file in keys:
+                result_cache.put(keys[file], data_point)
 
-        data_point = {HEADER[0]: bID_mID_oID,
-                      HEADER[1]: priviledged_flow,
-        }
-        
-        FEATURES = FEATURES.append(data_point, ignore_index = True)
+        if error is not None:
+            print("Error in processing file:", file)
+            print(error)
+        else:
+            writer.writerow(data_point)
+            output_file.flush()
 
         print("********** " + str(counter) + " JSON file(s) processed **********\n")
         counter = counter+ 1
 
-    FEATURES.to_csv("features.csv", index=False)
+    output_file.close()
+
+    if result_cache is not None:
+        print("Files taken from the cache:", len(cached))
+        result_cache.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+# Main function of the dataset mode: loads every EFG of the file list into one Dataset and writes DATASET_FEATURES for all of them
+def main_dataset(filepath, host_ipcns, cluster_ipcns, output = OUTPUT_PATH):
+
+    if np is None:
+        raise Exception("The dataset mode needs numpy")
+
+    set_configuration(host_ipcns, cluster_ipcns)
+
+    with open(filepath, "r") as f:
+        files = [line.strip() for line in f if line.strip()]
+
+    dataset = Dataset()
+    for file in files:
+        try:
+            dataset.add_graph(file)
+        except Exception as e:
+            print("Error in processing file:", file)
+            print(repr(e))
+
+    print("********** " + str(len(dataset.centers)) + " JSON file(s) loaded **********\n")
+
+    features = extract_dataset_features(dataset)
+
+    with open(output, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow([HEADER[0]] + DATASET_FEATURES)
+        for (graph, identifier) in enumerate(dataset.identifiers):
+            writer.writerow([identifier] + [int(features[column][graph]) for column in DATASET_FEATURES])
+
+
+# Function to separate '--option value' pairs from the positional arguments
+def parse_options(argv, exception_msg):
+    arguments = []
+    options = {"jobs": 1, "output": OUTPUT_PATH, "cache": None, "use_cache": True, "graph_cache": None}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--jobs" and index + 1 < len(argv):
+            options["jobs"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--output" and index + 1 < len(argv):
+            options["output"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--cache" and index + 1 < len(argv):
+            options["cache"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--graph-cache" and index + 1 < len(argv):
+            options["graph_cache"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--no-cache":
+            options["use_cache"] = False
+            index = index + 1
+        elif argv[index].startswith("--"):
+            raise Exception(exception_msg)
+        else:
+            arguments.append(argv[index])
+            index = index + 1
+
+    return arguments, options
 
 
 if __name__ == '__main__':
-    exception_docker = "For Docker:\n\trun python3 csv_generator.py docker <filepath> <host_ipcns>"
-    exception_kube = "For Kubernetes:\n\trun python3 csv_generator.py kube <filepath> <host_ipcns> <cluster_ipcns> <policy_number>"
-    exception_msg = exception_docker + "\n" + exception_kube
+    exception_docker = "For Docker:\n\trun python3 csv_generator.py [--jobs <N>] [--output <path>] [--cache <path> | --no-cache] [--graph-cache <dir>] docker <filepath> <host_ipcns>"
+    exception_kube = "For Kubernetes:\n\trun python3 csv_generator.py [--jobs <N>] [--output <path>] [--cache <path> | --no-cache] [--graph-cache <dir>] kube <filepath> <host_ipcns> <cluster_ipcns> <policy_number>"
+    exception_all = "For all features in one pass:\n\trun python3 csv_generator.py [--jobs <N>] [--output <path>] [--cache <path> | --no-cache] [--graph-cache <dir>] all <filepath> <host_ipcns> <cluster_ipcns> [<feature_name,...>]"
+    exception_dataset = "For all EFGs at once (needs numpy):\n\trun python3 csv_generator.py [--output <path>] dataset <filepath> <host_ipcns> <cluster_ipcns>"
+    exception_msg = exception_docker + "\n" + exception_kube + "\n" + exception_all + "\n" + exception_dataset
     try:
-        if len(sys.argv) < 2:
+        argv, options = parse_options(sys.argv, exception_msg)
+        if len(argv) < 2:
             raise Exception(exception_msg)
         else:
 
-            if sys.argv[1] == "docker":
-                if len(sys.argv) == 4:
+            if argv[1] == "docker":
+                if len(argv) == 4:
+                    print("Starting...")
+                    print("Filepath:", argv[2])
+                    print("Host IPCNS:", argv[3])
+                    main(argv[2], extract_priviledge_flow_docker, argv[3], **options)
+                else:
+                    raise Exception(exception_msg)
+
+            elif argv[1] == "kube":
+                if len(argv) == 6:
+                    print("Starting...")
+                    print("Filepath:", argv[2])
+                    print("Host IPCNS:", argv[3])
+                    print("Cluster IPCNS:", argv[4])
+                    print("Policy number:", argv[5])
+                    main(argv[2], extract_priviledge_flow_kubernetes, argv[3], argv[4], argv[5], **options)
+                else:
+                    raise Exception(exception_msg)
+
+            elif argv[1] == "all":
+                if len(argv) == 5 or len(argv) == 6:
+                    feature_names = argv[5].split(",") if len(argv) == 6 else list(FEATURE_FUNCTIONS)
+                    for name in feature_names:
+                        if name not in FEATURE_FUNCTIONS:
+                            raise Exception("Unknown feature: " + name + "\nAvailable features: " + ",".join(FEATURE_FUNCTIONS))
                     print("Starting...")
-                    print("Filepath:", sys.argv[2])
-                    print("Host IPCNS:", sys.argv[3])
-                    main(sys.argv[2], extract_priviledge_flow_docker, sys.argv[3])
+                    print("Filepath:", argv[2])
+                    print("Host IPCNS:", argv[3])
+                    print("Cluster IPCNS:", argv[4])
+                    print("Features:", ",".join(feature_names))
+                    main(argv[2], None, argv[3], argv[4], feature_names = feature_names, **options)
                 else:
                     raise Exception(exception_msg)
 
-            elif sys.argv[1] == "kube":
-                if len(sys.argv) == 6:
+            elif argv[1] == "dataset":
+                if len(argv) == 5:
                     print("Starting...")
-                    print("Filepath:", sys.argv[2])
-                    print("Host IPCNS:", sys.argv[3])
-                    print("Cluster IPCNS:", sys.argv[4])
-                    print("Policy number:", sys.argv[5])
-                    main(sys.argv[2], extract_priviledge_flow_kubernetes, sys.argv[3], sys.argv[4], sys.argv[5])
+                    print("Filepath:", argv[2])
+                    print("Host IPCNS:", argv[3])
+                    print("Cluster IPCNS:", argv[4])
+                    main_dataset(argv[2], argv[3], argv[4], output = options["output"])
                 else:
                     raise Exception(exception_msg)
 
@@ -0,0 +1,117 @@
+from tempfile import TemporaryDirectory
+from unittest import mock
+import unittest
+import json
+import os
+
+import extract_privilegedflow
+
+
+# Function to create a CamFlow vertex
+def vertex(id, object_id):
+    return {"type": "Entity", "id": id, "annotations": {"object_type": "file", "boot_id": "1", "cf:machine_id": "cf:2", "object_id": object_id, "path": "/tmp/" + object_id}}
+
+
+class TestReadObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.efg_path = os.path.join(self.directory.name, "efg.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Small chunks cut the objects of an indented export anywhere, even inside strings and literals
+    def test_objects_across_chunks(self):
+        objects = [vertex("v" + str(index), str(index)) for index in range(50)]
+        with open(self.efg_path, "w") as f:
+            json.dump(objects, f, indent=2)
+
+        with mock.patch.object(extract_privilegedflow, "READ_SIZE", 7):
+            read = list(extract_privilegedflow.read_objects(self.efg_path))
+
+        self.assertEqual([obj["id"] for obj in read], [obj["id"] for obj in objects])
+        self.assertNotIn("path", read[0]["annotations"])
+
+    # A malformed object fails right away instead of buffering the rest of the file
+    def test_corrupt_object_with_large_tail(self):
+        lines = [json.dumps(vertex("v0", "0")), '{"type": "Entity", "id": "v1", "annotations": {"object_id": }}']
+        lines.extend(json.dumps(vertex("v" + str(index), str(index))) for index in range(2, 50000))
+        with open(self.efg_path, "w") as f:
+            f.write("[\n" + "\n,".join(lines) + "\n]\n")
+
+        read_sizes = []
+        def tracked_open(*args, **kwargs):
+            f = open(*args, **kwargs)
+            read = f.read
+            f.read = lambda size: read_sizes.append(size) or read(size)
+            return f
+
+        objects = extract_privilegedflow.read_objects(self.efg_path)
+        with mock.patch.object(extract_privilegedflow, "open", tracked_open, create=True):
+            self.assertEqual(next(objects)["id"], "v0")
+            with self.assertRaises(json.JSONDecodeError):
+                next(objects)
+
+        self.assertEqual(read_sizes, [extract_privilegedflow.READ_SIZE])
+        self.assertGreater(os.path.getsize(self.efg_path), 10 * extract_privilegedflow.READ_SIZE)
+
+
+class TestGraphCache(unittest.TestCase):
+
+    # A center file read and written by tasks in three namespaces, plus edges that do not touch it
+    #   The center entity is named by the file name, so the EFG is read from inside its directory like main does
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory.name)
+        self.efg_path = "b_m_o_1_graph.json"
+
+        objects = [{"type": "Entity", "id": "center", "annotations": {"boot_id": "b", "cf:machine_id": "cf:m", "object_id": "o", "object_type": "file"}}]
+        for index in range(12):
+            objects.append({"type": "Activity", "id": "t" + str(index), "annotations": {"object_id": str(index), "ipcns": ["host", "cluster", "pod"][index % 3], "pidns": str(index % 2)}})
+        for index in range(12):
+            if index % 2 == 0:
+                objects.append({"type": "Used", "from": "t" + str(index), "to": "center", "annotations": {"from_type": "task"}})
+            else:
+                objects.append({"type": "WasGeneratedBy", "from": "center", "to": "t" + str(index), "annotations": {"from_type": "file"}})
+            objects.append({"type": "WasInformedBy", "from": "t" + str(index), "to": "t" + str((index + 1) % 12), "annotations": {"from_type": "task"}})
+        with open(self.efg_path, "w") as f:
+            json.dump(objects, f)
+
+        extract_privilegedflow.set_configuration("host", "cluster")
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    # Function to evaluate every feature on an EFG
+    def features(self, efg):
+        extract_privilegedflow.set_center_entity(efg, self.efg_path)
+        return {name: function(efg) for (name, function) in extract_privilegedflow.FEATURE_FUNCTIONS.items()}
+
+    def test_cached_features(self):
+        graph_cache = "graphs"
+        expected = self.features(extract_privilegedflow.load_data(self.efg_path))
+
+        self.assertEqual(self.features(extract_privilegedflow.load_graph(self.efg_path, graph_cache)), expected)
+        cached = extract_privilegedflow.load_graph(self.efg_path, graph_cache)
+        self.assertEqual(self.features(cached), expected)
+        self.assertEqual(extract_privilegedflow.extract_identifier(cached), "b_m_o")
+
+        # Only the center entity and its readers and writers are read back
+        self.assertEqual(len(cached.vertex_by_id), 13)
+
+    def test_cached_missing_center(self):
+        graph_cache = "graphs"
+        extract_privilegedflow.load_graph(self.efg_path, graph_cache)
+        cache_path = extract_privilegedflow.graph_cache_path(graph_cache, self.efg_path)
+
+        # A valid cache without the entity is not a cache miss, it gives a graph without a center
+        efg = extract_privilegedflow.read_graph_cache(cache_path, os.stat(self.efg_path), ("b", "cf:m", "missing"))
+        self.assertIsNotNone(efg)
+        self.assertEqual(efg.vertex_by_entity, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
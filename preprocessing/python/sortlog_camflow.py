@@ -1,25 +1,145 @@
-from json import loads
-from queue import PriorityQueue
+from json import loads, dumps
+from hashlib import blake2b
+from heapq import merge, heappush, heappop
+from collections import deque
+from tempfile import mkdtemp
+from multiprocessing import Pool
+from array import array
+from glob import glob
+import shutil
+import select
+import mmap
+import gzip
+import bz2
+import lzma
+import io
+import math
+import time
+import re
 import sys
 import os
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 '''
  --------------------------------------------------------------------------------
  @What it does?
     The following Python module is designed to ingest a CamFlow log and sort it
     in a way that all vertices are piled up at the top followed by all the edges
-    sorted in a sequential order based on their 'relation_id'. 
- 
+    sorted in a sequential order based on their 'relation_id'.
+
+    Several input logs (paths or glob patterns, e.g. rotated or per-CPU logs)
+    can be given. Their vertices are written in the given order and their
+    edges are merged by 'relation_id' into one output. Every log is read as a
+    stream and its edges are kept in a sorted run on disk.
+
  @When should you use it?
     If there is a strict need in a module that requires a vertex to be present
-    before the edge of that vertex is encountered in a log then this Python 
-    module can help you bring your CamFlow log in a desired shape. 
- 
- @authors 
+    before the edge of that vertex is encountered in a log then this Python
+    module can help you bring your CamFlow log in a desired shape.
+
+ @Options
+    --max-memory <size>     Bound the memory used for buffering edges (e.g.
+                            512M, 2G). Sorted runs of edges are spilled to
+                            temporary files and merged into the output, at
+                            most 64 runs at a time.
+    --workers <N>           Split the input at newline-aligned byte offsets
+                            and parse the chunks in N processes. The output
+                            is in the same order as the single process run.
+    --full-decode           Decode every line with json.loads instead of
+                            scanning the raw line for 'type' and
+                            'relation_id'. Useful to compare both paths.
+    Input and output paths ending in .gz, .bz2, .xz or .lzma are read and
+    written compressed. Compressed inputs are also recognized by their magic
+    bytes. Uncompressed inputs are read through mmap.
+
+    --offset-index          Keep only (relation_id, offset, length) of every
+                            edge in compact arrays, sort them and copy the
+                            edge bytes from an mmap of the input. Needs
+                            numpy and an uncompressed input, and cannot be
+                            given with --workers or --max-memory. Edges
+                            with the same relation_id keep their input
+                            order.
+    --dedup                 Drop vertices whose 'id' was already written and
+                            edges repeating a ('relation_id', 'id') pair.
+                            Vertex ids are remembered in a Bloom filter so
+                            memory stays fixed; edges are compared with
+                            their neighbours in relation_id order. In
+                            follow mode, where late edges come out of
+                            order, the (relation_id, id) pairs of the last
+                            --max-buffer edges are remembered instead.
+    --dedup-capacity <N>    Number of distinct vertices the Bloom filter is
+                            sized for (default 10000000).
+    --follow                Keep reading a growing log (or stdin when the
+                            input path is '-') and write vertices right
+                            away. Edges are held in a reorder buffer and
+                            written in 'relation_id' order once the
+                            watermark has passed them.
+    --window <N>            Follow mode: an edge is written once an edge
+                            with a relation_id N higher has been read.
+    --max-buffer <N>        Follow mode: most edges held in the reorder
+                            buffer. The lowest edges are written early
+                            when it is full.
+    --flush-after <secs>    Follow mode: write out the whole reorder buffer
+                            when no new data arrives for this long.
+    --vertex-drop-keys <k1,k2,...>
+    --edge-drop-keys <k1,k2,...>
+                            Remove these annotations from every vertex (or
+                            edge), as SPADE's DropKeys filter does with
+                            'VertexDropKeys' and 'EdgeDropKeys'. 'type' may
+                            not be removed.
+    --vertex-keep-keys <k1,k2,...>
+    --edge-keep-keys <k1,k2,...>
+                            Keep only these annotations (and 'type') on
+                            every vertex (or edge), instead of listing the
+                            ones to drop.
+                            With any of these four options every record is
+                            decoded and written back as compact JSON, so the
+                            sorted log (and the edges buffered on disk) get
+                            smaller before they reach SPADE.
+
+ @authors
     Shahpar Khan, Mashal Abbas
  --------------------------------------------------------------------------------
 '''
 
+USAGE = "run python3 sortlog.py [[--max-memory <size>] [--workers <N>] | --offset-index] [--full-decode] [--dedup [--dedup-capacity <N>]] [--follow [--window <N>] [--max-buffer <N>] [--flush-after <secs>]] [--vertex-drop-keys <k,...> | --vertex-keep-keys <k,...>] [--edge-drop-keys <k,...> | --edge-keep-keys <k,...>] <input_log_path>... <output_log_name>"
+
+# Number of chunks handed to each worker so that uneven chunks still balance out
+CHUNKS_PER_WORKER = 4
+
+# Compressed streams recognized by file extension and by magic bytes
+EXTENSION_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open, ".lzma": lzma.open}
+MAGIC_OPENERS = [(b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open)]
+
+# Buffer size used for reading and writing logs
+IO_BUFFER_SIZE = 1024 * 1024
+
+# Sizing of the Bloom filter remembering vertex ids
+DEDUP_CAPACITY = 10000000
+DEDUP_ERROR_RATE = 0.000001
+
+# Defaults of the follow mode
+FOLLOW_WINDOW = 1000
+FOLLOW_MAX_BUFFER = 100000
+FOLLOW_FLUSH_AFTER = 5.0
+FOLLOW_POLL_INTERVAL = 0.5
+FOLLOW_READ_SIZE = 65536
+
+# Patterns used by the fast path to pull 'type' and 'relation_id' out of a raw line
+TYPE_PATTERN = re.compile(rb'"type"\s*:\s*"([A-Za-z]+)"')
+ID_PATTERN = re.compile(rb'"id"\s*:\s*"([^"\\]*)"')
+RELATION_ID_PATTERN = re.compile(rb'"relation_id"\s*:\s*(?:"(\d+)"|(\d+))\s*[,}]')
+
+# Approximate bytes used by Python for every buffered (relation_id, line) tuple on top of the line itself
+EDGE_OVERHEAD = 120
+
+# Most runs read at the same time by a merge, more runs are first merged into intermediate runs
+MERGE_FAN_IN = 64
+
 
 # Function that returns True if the current JSON object is a vertex --- False if it is an edge
 def isVertex(obj):
@@ -42,71 +162,980 @@ def extractRelationID(obj):
     return None
 
 
-# Function to dump all the edges in priority queue based on the relation_ids
-def dumpPriorityQueue(pq, output_file):
+# Class that finds whether a line is a vertex and its relation_id, scanning the raw line when it can
+class KeyScanner:
+
+    def __init__(self, fast_path=True):
+        self.fast_path = fast_path
+        self.counts = {"fast": 0, "full": 0}
+
+    # Function that returns (True, None) for a vertex and (False, relation_id) for an edge
+    def extractKey(self, line):
+        if self.fast_path:
+            key = scanKey(line)
+            if key is not None:
+                self.counts["fast"] = self.counts["fast"] + 1
+                return key
+
+        obj = loads(line)
+        self.counts["full"] = self.counts["full"] + 1
+        if isVertex(obj):
+            return (True, None)
+
+        return (False, extractRelationID(obj))
+
+    # Function to add the counts of another scanner, e.g. one returned by a worker
+    def addCounts(self, other):
+        for path in self.counts:
+            self.counts[path] = self.counts[path] + other.counts[path]
+
+    # Function to print how many lines took each path
+    def report(self):
+        print("Lines keyed by the fast path:", self.counts["fast"])
+        print("Lines keyed by full JSON decoding:", self.counts["full"])
+
+
+# Function to pull the key of a line without decoding it --- None if the line needs a full decode
+def scanKey(line):
+
+    stripped = line.strip()
+    if not (stripped.startswith(b"{") and stripped.endswith(b"}")):
+        return None
+
+    types = TYPE_PATTERN.findall(stripped)
+    if len(types) != 1:
+        return None
+
+    if (types[0] == b"Entity") or (types[0] == b"Activity"):
+        return (True, None)
+
+    relation_ids = RELATION_ID_PATTERN.findall(stripped)
+    if len(relation_ids) != 1:
+        return None
+
+    (quoted, unquoted) = relation_ids[0]
+
+    return (False, int(quoted or unquoted))
+
+
+# Function to pull the 'id' of a record from its raw line --- the whole line if the record has no id
+def extractID(line):
+
+    ids = ID_PATTERN.findall(line)
+    if len(ids) == 1:
+        return ids[0]
+
+    try:
+        return str(loads(line)["id"]).encode()
+    except:
+        return line
+
+
+# Class implementing a Bloom filter: a fixed size set that can answer 'seen' for an unseen key with a small probability
+class BloomFilter:
+
+    def __init__(self, capacity=DEDUP_CAPACITY, error_rate=DEDUP_ERROR_RATE):
+        bit_count = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.capacity = capacity
+        self.bit_count = bit_count
+        self.hash_count = max(int(round(bit_count / capacity * math.log(2))), 1)
+        self.bits = bytearray((bit_count + 7) // 8)
+        self.size = 0
+
+    # Function that adds a key and returns True if the key was (probably) already present
+    def add(self, key):
+        digest = blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        present = True
+        for index in range(self.hash_count):
+            bit = (first + index * second) % self.bit_count
+            mask = 1 << (bit & 7)
+            if not self.bits[bit >> 3] & mask:
+                present = False
+                self.bits[bit >> 3] = self.bits[bit >> 3] | mask
+
+        if not present:
+            self.size = self.size + 1
+
+        return present
+
+
+# Class that drops repeated vertices and edges before they are written
+#   recent is the number of edges remembered in follow mode, where edges are not written in relation_id order
+class Deduplicator:
+
+    def __init__(self, capacity=DEDUP_CAPACITY, recent=None):
+        self.vertex_ids = BloomFilter(capacity)
+        self.relation_id = None
+        self.edge_ids = set()
+        self.recent = recent
+        self.recent_edges = set()
+        self.recent_order = deque()
+        self.counts = {"vertices": 0, "duplicate_vertices": 0, "edges": 0, "duplicate_edges": 0}
+
+    # Function that returns True if the vertex line has not been written yet
+    def newVertex(self, line):
+        self.counts["vertices"] = self.counts["vertices"] + 1
+        if self.vertex_ids.add(extractID(line)):
+            self.counts["duplicate_vertices"] = self.counts["duplicate_vertices"] + 1
+            return False
+
+        return True
+
+    # Function that returns True if the edge has not been written yet --- edges must come in relation_id order unless recent is given
+    def newEdge(self, relation_id, line):
+        self.counts["edges"] = self.counts["edges"] + 1
+        if self.recent is not None:
+            return self.newRecentEdge(relation_id, line)
+
+        if relation_id != self.relation_id:
+            self.relation_id = relation_id
+            self.edge_ids = set()
+
+        edge_id = extractID(line)
+        if edge_id in self.edge_ids:
+            self.counts["duplicate_edges"] = self.counts["duplicate_edges"] + 1
+            return False
+
+        self.edge_ids.add(edge_id)
+        return True
+
+    # Function that returns True if the edge is not among the last recent edges
+    def newRecentEdge(self, relation_id, line):
+        edge_key = (relation_id, extractID(line))
+        if edge_key in self.recent_edges:
+            self.counts["duplicate_edges"] = self.counts["duplicate_edges"] + 1
+            return False
+
+        self.recent_edges.add(edge_key)
+        self.recent_order.append(edge_key)
+        if len(self.recent_order) > self.recent:
+            self.recent_edges.discard(self.recent_order.popleft())
+
+        return True
+
+    # Function to print how many records were dropped
+    def report(self):
+        print("Duplicate vertices dropped:", self.counts["duplicate_vertices"], "of", self.counts["vertices"])
+        print("Duplicate edges dropped:", self.counts["duplicate_edges"], "of", self.counts["edges"])
+        if self.vertex_ids.size > self.vertex_ids.capacity:
+            print("Warning: more distinct vertices than --dedup-capacity, some unique vertices may have been dropped")
+
+
+# Function to split a comma separated list of annotation keys, rejecting empty keys and 'type' as DropKeys does
+def parseKeys(keys, option):
+
+    if keys is None:
+        return None
+
+    parsed = set()
+    for key in keys.split(","):
+        key = key.strip()
+        if not key:
+            raise Exception("Empty key in '" + option + "' argument. Invalid arguments")
+        parsed.add(key)
+
+    return parsed
+
+
+# Class that removes annotations from vertices and edges and writes them back as compact JSON
+class AnnotationProjector:
+
+    def __init__(self, vertex_drop_keys=None, edge_drop_keys=None, vertex_keep_keys=None, edge_keep_keys=None):
+        if vertex_drop_keys is not None and vertex_keep_keys is not None:
+            raise Exception("Give either '--vertex-drop-keys' or '--vertex-keep-keys'")
+        if edge_drop_keys is not None and edge_keep_keys is not None:
+            raise Exception("Give either '--edge-drop-keys' or '--edge-keep-keys'")
+
+        self.drop_keys = {True: parseKeys(vertex_drop_keys, "--vertex-drop-keys"), False: parseKeys(edge_drop_keys, "--edge-drop-keys")}
+        self.keep_keys = {True: parseKeys(vertex_keep_keys, "--vertex-keep-keys"), False: parseKeys(edge_keep_keys, "--edge-keep-keys")}
+
+        for drop_keys in self.drop_keys.values():
+            if drop_keys is not None and "type" in drop_keys:
+                raise Exception("Cannot remove 'type' key. Invalid arguments")
+        for keep_keys in self.keep_keys.values():
+            if keep_keys is not None:
+                keep_keys.add("type")
+
+        self.counts = {"records": 0, "bytes_before": 0, "bytes_after": 0}
+
+    # Function that returns the line of a vertex (or edge) without the dropped annotations, as compact JSON
+    def project(self, line, vertex):
+        obj = loads(line)
+
+        annotations = obj.get("annotations")
+        if isinstance(annotations, dict):
+            drop_keys = self.drop_keys[vertex]
+            keep_keys = self.keep_keys[vertex]
+            if drop_keys is not None:
+                obj["annotations"] = {key: value for (key, value) in annotations.items() if key not in drop_keys}
+            elif keep_keys is not None:
+                obj["annotations"] = {key: value for (key, value) in annotations.items() if key in keep_keys}
+
+        projected = dumps(obj, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+
+        self.counts["records"] = self.counts["records"] + 1
+        self.counts["bytes_before"] = self.counts["bytes_before"] + len(line)
+        self.counts["bytes_after"] = self.counts["bytes_after"] + len(projected)
+
+        return projected
+
+    # Function to add the counts of another projector, e.g. one returned by a worker
+    def addCounts(self, other):
+        for name in self.counts:
+            self.counts[name] = self.counts[name] + other.counts[name]
+
+    # Function to print how much the records shrank
+    def report(self):
+        print("Records projected:", self.counts["records"])
+        print("Bytes before and after projection:", self.counts["bytes_before"], self.counts["bytes_after"])
+
+
+# Function to convert a size like 4096, 512K, 512M or 2G into a number of bytes
+def parseSize(size):
+
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+# Function that returns the opener of a compressed log --- None if the log is not compressed
+def compressionOpener(log_path, mode):
+
+    for (extension, opener) in EXTENSION_OPENERS.items():
+        if log_path.endswith(extension):
+            return opener
+
+    if "r" in mode and os.path.isfile(log_path):
+        with open(log_path, 'rb') as log_file:
+            magic = log_file.read(6)
+        for (prefix, opener) in MAGIC_OPENERS:
+            if magic.startswith(prefix):
+                return opener
+
+    return None
+
+
+# Function to open a log in binary mode with a large buffer, compressed or not
+def openLog(log_path, mode):
+
+    opener = compressionOpener(log_path, mode)
+    if opener is None:
+        return open(log_path, mode, buffering=IO_BUFFER_SIZE)
+
+    if "r" in mode:
+        return io.BufferedReader(opener(log_path, mode), IO_BUFFER_SIZE)
+
+    return io.BufferedWriter(opener(log_path, mode), IO_BUFFER_SIZE)
+
+
+# Class that iterates over the lines of an uncompressed log through mmap
+class MappedLog:
+
+    def __init__(self, log_path):
+        self.file = open(log_path, 'rb')
+        self.map = None
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        if self.map is None:
+            return iter(())
+
+        return iter(self.map.readline, b"")
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
 
-    while not pq.empty():
-        (_, line) = pq.get()
-        output_file.write(line)
 
+# Function to open an input log for reading line by line
+def openInput(input_log_path):
 
-# Function to read log at a given path 
-def readWriteLog(input_log_path, output_log_name):
+    if compressionOpener(input_log_path, 'rb') is not None:
+        return openLog(input_log_path, 'rb')
+
+    return MappedLog(input_log_path)
+
+
+# Class that buffers edges and keeps their memory bounded by spilling sorted runs to temporary files
+class EdgeRuns:
+
+    def __init__(self, max_memory=None, run_dir=None, run_prefix="run_"):
+        self.max_memory = max_memory
+        self.edges = []
+        self.buffered_bytes = 0
+        self.run_dir = run_dir
+        self.owns_run_dir = run_dir is None
+        self.run_prefix = run_prefix
+        self.run_paths = []
+        self.merged_runs = 0
+        self.readers = []
+
+    # Function to buffer an edge and spill the buffer once it goes past the memory bound
+    def add(self, relation_id, line):
+        self.edges.append((relation_id, line))
+
+        if self.max_memory is not None:
+            self.buffered_bytes = self.buffered_bytes + len(line) + EDGE_OVERHEAD
+            if self.buffered_bytes >= self.max_memory:
+                self.spill()
+
+    # Function that returns the directory holding the runs, creating it when needed
+    def runDirectory(self):
+        if self.run_dir is None:
+            self.run_dir = mkdtemp(prefix="sortlog_camflow_")
+
+        return self.run_dir
+
+    # Function to write the buffered edges as one sorted run
+    def spill(self):
+        if not self.edges:
+            return
+
+        self.edges.sort()
+        run_path = os.path.join(self.runDirectory(), self.run_prefix + str(len(self.run_paths)))
+        with open(run_path, "wb") as run_file:
+            for (relation_id, line) in self.edges:
+                run_file.write(b"%d " % relation_id + line)
+
+        self.run_paths.append(run_path)
+        self.edges = []
+        self.buffered_bytes = 0
+
+    # Function to merge the runs in groups of MERGE_FAN_IN until at most max_runs runs are left
+    def reduceRuns(self, max_runs=MERGE_FAN_IN):
+        while len(self.run_paths) > max_runs:
+            run_paths = []
+            for start in range(0, len(self.run_paths), MERGE_FAN_IN):
+                group = self.run_paths[start:start + MERGE_FAN_IN]
+                if len(group) == 1:
+                    run_paths.extend(group)
+                    continue
+
+                run_path = os.path.join(self.runDirectory(), self.run_prefix + "merged_" + str(self.merged_runs))
+                self.merged_runs = self.merged_runs + 1
+                self.readers = [readRun(path) for path in group]
+                with open(run_path, "wb") as run_file:
+                    for (relation_id, line) in merge(*self.readers):
+                        run_file.write(b"%d " % relation_id + line)
+                self.readers = []
+
+                for path in group:
+                    os.remove(path)
+                run_paths.append(run_path)
+
+            self.run_paths = run_paths
+
+    # Function that yields all edges (relation_id, line) in sorted order
+    def sortedEdges(self):
+        if not self.run_paths:
+            self.edges.sort()
+            return iter(self.edges)
+
+        self.spill()
+        self.reduceRuns()
+        self.readers = [readRun(run_path) for run_path in self.run_paths]
+        return merge(*self.readers)
+
+    # Function to close the runs being read and remove the temporary runs
+    def close(self):
+        self.edges = []
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+        if self.run_dir is not None and self.owns_run_dir:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.run_paths = []
+
+
+# Function to read back a run written by EdgeRuns.spill
+def readRun(run_path):
+
+    with open(run_path, "rb") as run_file:
+        for record in run_file:
+            (relation_id, line) = record.split(b" ", 1)
+            yield (int(relation_id), line)
+
+
+# Function to write (relation_id, line) edges, skipping the duplicates when a deduplicator is given
+def writeEdges(edges, output_file, deduplicator=None):
+
+    if deduplicator is not None:
+        edges = (edge for edge in edges if deduplicator.newEdge(edge[0], edge[1]))
+
+    output_file.writelines(line for (_, line) in edges)
+
+
+# Function to dump all the edges in sorted order based on the relation_ids
+def dumpEdges(edge_runs, output_file, deduplicator=None):
+
+    writeEdges(edge_runs.sortedEdges(), output_file, deduplicator)
+
+
+# Function to write a vertex line straight to the output and buffer an edge line by its relation_id
+def ingestLine(line, output_file, edge_runs, key_scanner, deduplicator=None, projector=None):
+
+    if not line.endswith(b"\n"):
+        line = line + b"\n"
+
+    try:
+        (vertex, relation_id) = key_scanner.extractKey(line)
+        if projector is not None:
+            line = projector.project(line, vertex)
+        if vertex:
+            if deduplicator is None or deduplicator.newVertex(line):
+                output_file.write(line)
+        else:
+            if relation_id is None:
+                raise ValueError("Missing relation_id")
+            edge_runs.add(relation_id, line)
+    except:
+        print("Error in ingesting the following line:")
+        print(line.decode(errors="replace"))
+
+
+# Function to put an output log back to the size it had before a failed sort, removing it if it did not exist
+def restoreOutput(output_log_name, output_size):
+
+    if not os.path.exists(output_log_name):
+        return
+
+    if output_size is None:
+        os.remove(output_log_name)
+    else:
+        os.truncate(output_log_name, output_size)
+
+
+# Function to expand glob patterns into the list of input logs, keeping the given order
+def expandInputs(input_log_paths):
+
+    if isinstance(input_log_paths, str):
+        input_log_paths = [input_log_paths]
+
+    expanded = []
+    for pattern in input_log_paths:
+        matches = sorted(glob(pattern))
+        if matches:
+            expanded.extend(matches)
+        else:
+            expanded.append(pattern)
+
+    return expanded
+
+
+# Function to split a file into byte ranges that start and end on line boundaries
+def splitOffsets(input_log_path, chunk_count):
+
+    size = os.path.getsize(input_log_path)
+    offsets = [0]
+
+    with open(input_log_path, 'rb') as input_file:
+        for chunk_index in range(1, chunk_count):
+            input_file.seek(size * chunk_index // chunk_count)
+            input_file.readline()
+            offset = input_file.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+
+    offsets.append(size)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+# Function run by every worker: sorts the edges of one byte range into runs and writes its vertices to a file
+def ingestChunk(task):
+
+    (input_log_path, chunk_index, start, end, max_memory, run_dir, fast_path, projector) = task
+
+    vertex_path = os.path.join(run_dir, "vertices_" + str(chunk_index))
+    edge_runs = EdgeRuns(max_memory, run_dir, "run_" + str(chunk_index) + "_")
+    key_scanner = KeyScanner(fast_path)
+
+    input_file = MappedLog(input_log_path)
+
+    with open(vertex_path, 'wb', buffering=IO_BUFFER_SIZE) as vertex_file:
+        if input_file.map is not None:
+            input_file.map.seek(start)
+            while input_file.map.tell() < end:
+                line = input_file.map.readline()
+                if not line:
+                    break
+                ingestLine(line, vertex_file, edge_runs, key_scanner, projector=projector)
+
+    input_file.close()
+
+    # One run per chunk, so the runs left for the final merge do not multiply with --max-memory
+    edge_runs.spill()
+    edge_runs.reduceRuns(1)
+
+    return vertex_path, edge_runs.run_paths, key_scanner, projector
+
+
+# Function to read logs at given paths with a pool of worker processes
+def readWriteLogParallel(input_log_paths, output_log_name, workers, max_memory=None, key_scanner=None, deduplicator=None, projector=None):
+
+    try:
+        output_file = openLog(output_log_name, "ab")
+    except:
+        print("Error in opening file with name:", output_log_name)
+
+    # Every worker gets an equal share of the memory bound
+    if max_memory is not None:
+        max_memory = max(max_memory // workers, 1)
+
+    if key_scanner is None:
+        key_scanner = KeyScanner()
+
+    edge_runs = EdgeRuns()
+
+    try:
+        run_dir = edge_runs.runDirectory()
+        chunks = [(input_log_path, start, end) for input_log_path in expandInputs(input_log_paths) for (start, end) in splitOffsets(input_log_path, workers * CHUNKS_PER_WORKER)]
+        tasks = [(input_log_path, chunk_index, start, end, max_memory, run_dir, key_scanner.fast_path, projector) for (chunk_index, (input_log_path, start, end)) in enumerate(chunks)]
+
+        with Pool(workers) as pool:
+            # Chunks come back in input order so vertices keep their original order
+            for (vertex_path, run_paths, chunk_key_scanner, chunk_projector) in pool.imap(ingestChunk, tasks):
+                with open(vertex_path, 'rb') as vertex_file:
+                    if deduplicator is None:
+                        shutil.copyfileobj(vertex_file, output_file)
+                    else:
+                        output_file.writelines(line for line in vertex_file if deduplicator.newVertex(line))
+                os.remove(vertex_path)
+                edge_runs.run_paths.extend(run_paths)
+                key_scanner.addCounts(chunk_key_scanner)
+                if projector is not None:
+                    projector.addCounts(chunk_projector)
+
+        dumpEdges(edge_runs, output_file, deduplicator)
+
+    finally:
+        edge_runs.close()
+        output_file.close()
+
+
+# Function that returns the positions of the relation_ids in sorted order, stable for equal relation_ids
+#   NumPy sorts the compact array in place of a list of Python ints, which is what keeps the offset index small
+def sortedOrder(relation_ids):
+
+    return np.argsort(np.frombuffer(relation_ids, dtype=np.int64), kind='stable')
+
+
+# Function that yields the (relation_id, line) edges of the offset index in sorted order, sliced from the mapped logs
+def indexedEdges(maps, relation_ids, file_indexes, offsets, lengths):
+
+    for index in sortedOrder(relation_ids):
+        input_map = maps[file_indexes[index]]
+        start = offsets[index]
+        end = start + lengths[index]
+
+        # Only the last line of a log can miss its newline, the slice is cut short and completed here
+        if end > len(input_map):
+            yield (relation_ids[index], input_map[start:] + b"\n")
+        else:
+            yield (relation_ids[index], input_map[start:end])
+
+
+# Function to read logs at given paths, keeping only the offsets of the edges in memory
+def readWriteLogIndexed(input_log_paths, output_log_name, key_scanner=None, deduplicator=None, projector=None):
 
     # Opening files
+    input_files = []
+    for input_log_path in expandInputs(input_log_paths):
+        try:
+            input_files.append(MappedLog(input_log_path))
+        except:
+            print("Error in opening file at path:", input_log_path)
+
     try:
-        input_file = open(input_log_path, 'r')
+        output_file = openLog(output_log_name, "ab")
+    except:
+        print("Error in opening file with name:", output_log_name)
+
+    if key_scanner is None:
+        key_scanner = KeyScanner()
+
+    relation_ids = array('q')
+    file_indexes = array('H')
+    offsets = array('Q')
+    lengths = array('L')
+
+    try:
+        for (file_index, input_file) in enumerate(input_files):
+            input_map = input_file.map
+            if input_map is None:
+                continue
+
+            offset = 0
+            line = input_map.readline()
+            while line:
+                if not line.endswith(b"\n"):
+                    line = line + b"\n"
+                try:
+                    (vertex, relation_id) = key_scanner.extractKey(line)
+                    if vertex:
+                        if projector is not None:
+                            line = projector.project(line, vertex)
+                        if deduplicator is None or deduplicator.newVertex(line):
+                            output_file.write(line)
+                    else:
+                        if relation_id is None:
+                            raise ValueError("Missing relation_id")
+                        relation_ids.append(relation_id)
+                        file_indexes.append(file_index)
+                        offsets.append(offset)
+                        lengths.append(len(line))
+                except:
+                    print("Error in ingesting the following line:")
+                    print(line.decode(errors="replace"))
+
+                offset = input_map.tell()
+                line = input_map.readline()
+
+        maps = [input_file.map for input_file in input_files]
+        edges = indexedEdges(maps, relation_ids, file_indexes, offsets, lengths)
+
+        # The index points into the input, so edges are projected on their way out
+        if projector is not None:
+            edges = ((relation_id, projector.project(line, False)) for (relation_id, line) in edges)
+
+        writeEdges(edges, output_file, deduplicator)
+
+    finally:
+        output_file.close()
+        for input_file in input_files:
+            input_file.close()
+
+
+# Function to read logs at given paths
+def readWriteLog(input_log_paths, output_log_name, max_memory=None, key_scanner=None, deduplicator=None, projector=None):
+
+    input_log_paths = expandInputs(input_log_paths)
+
+    try:
+        output_file = openLog(output_log_name, "ab")
+    except:
+        print("Error in opening file with name:", output_log_name)
+
+    # Initializing edge buffer
+    edge_runs = EdgeRuns(max_memory)
+
+    if key_scanner is None:
+        key_scanner = KeyScanner()
+
+    try:
+        for input_log_path in input_log_paths:
+            # Opening files one at a time
+            try:
+                input_file = openInput(input_log_path)
+            except:
+                print("Error in opening file at path:", input_log_path)
+                continue
+
+            try:
+                for line in input_file:
+                    ingestLine(line, output_file, edge_runs, key_scanner, deduplicator, projector)
+            finally:
+                input_file.close()
+
+            # With several logs only the edges of one log are held in memory at a time
+            if len(input_log_paths) > 1:
+                edge_runs.spill()
+
+        dumpEdges(edge_runs, output_file, deduplicator)
+
+    finally:
+        edge_runs.close()
+        output_file.close()
+
+
+# Class that holds edges of a live log until the watermark passes their relation_id
+class ReorderBuffer:
+
+    def __init__(self, window=FOLLOW_WINDOW, max_buffer=FOLLOW_MAX_BUFFER):
+        self.window = window
+        self.max_buffer = max_buffer
+        self.heap = []
+        self.highest_relation_id = None
+        self.last_written_relation_id = None
+        self.counts = {"late": 0, "forced": 0}
+
+    # Function to buffer an edge and return the (relation_id, line) edges that are ready to be written
+    def push(self, relation_id, line):
+
+        # The watermark already passed this edge so it is written right away
+        if self.last_written_relation_id is not None and relation_id < self.last_written_relation_id:
+            self.counts["late"] = self.counts["late"] + 1
+            print("Late edge with relation_id", relation_id, "after", self.last_written_relation_id, file=sys.stderr)
+            return [(relation_id, line)]
+
+        heappush(self.heap, (relation_id, line))
+        if self.highest_relation_id is None or relation_id > self.highest_relation_id:
+            self.highest_relation_id = relation_id
+
+        ready = []
+        watermark = self.highest_relation_id - self.window
+        while self.heap and (self.heap[0][0] <= watermark or len(self.heap) > self.max_buffer):
+            if self.heap[0][0] > watermark:
+                self.counts["forced"] = self.counts["forced"] + 1
+            ready.append(self.pop())
+
+        return ready
+
+    # Function to return all buffered edges in order
+    def flush(self):
+        ready = []
+        while self.heap:
+            ready.append(self.pop())
+
+        return ready
+
+    def pop(self):
+        edge = heappop(self.heap)
+        self.last_written_relation_id = edge[0]
+
+        return edge
+
+    # Function to print how many edges could not be written in order
+    def report(self):
+        print("Late edges (written after the watermark passed them):", self.counts["late"])
+        print("Edges written early because the reorder buffer was full:", self.counts["forced"])
+
+
+# Function that yields chunks of a growing file or stdin --- b"" when nothing arrived within the poll interval, None at the end of stdin
+def followChunks(input_file, from_stdin):
+
+    while True:
+        if from_stdin:
+            (readable, _, _) = select.select([input_file], [], [], FOLLOW_POLL_INTERVAL)
+            if not readable:
+                yield b""
+                continue
+            chunk = os.read(input_file.fileno(), FOLLOW_READ_SIZE)
+            if not chunk:
+                yield None
+                return
+            yield chunk
+        else:
+            chunk = input_file.read(FOLLOW_READ_SIZE)
+            if not chunk:
+                time.sleep(FOLLOW_POLL_INTERVAL)
+            yield chunk
+
+
+# Function to sort a live log with a bounded reorder window
+def followLog(input_log_path, output_log_name, window=FOLLOW_WINDOW, max_buffer=FOLLOW_MAX_BUFFER, flush_after=FOLLOW_FLUSH_AFTER, key_scanner=None, deduplicator=None, projector=None):
+
+    from_stdin = input_log_path == "-"
+
+    # Opening files
+    try:
+        if not from_stdin and compressionOpener(input_log_path, 'rb') is not None:
+            raise ValueError("Cannot follow a compressed log")
+        input_file = sys.stdin.buffer if from_stdin else open(input_log_path, 'rb')
     except:
         print("Error in opening file at path:", input_log_path)
 
     try:
-        output_file = open(output_log_name, "a")
+        output_file = openLog(output_log_name, "ab")
     except:
-        print("Error in opening file with name:", output_log_name) 
-    
-    # Initializing priority queue
-    pq = PriorityQueue()
+        print("Error in opening file with name:", output_log_name)
+
+    if key_scanner is None:
+        key_scanner = KeyScanner()
+
+    reorder_buffer = ReorderBuffer(window, max_buffer)
+    partial_line = b""
+    last_data_time = time.monotonic()
+
+    try:
+        for chunk in followChunks(input_file, from_stdin):
+            if chunk is None:
+                # End of stdin, the last line may come without a newline
+                lines = [partial_line] if partial_line.strip() else []
+                partial_line = b""
+
+            elif not chunk:
+                # Nothing new for a while, so the edges still buffered are as complete as they will get
+                if reorder_buffer.heap and time.monotonic() - last_data_time >= flush_after:
+                    writeEdges(reorder_buffer.flush(), output_file, deduplicator)
+                    output_file.flush()
+                continue
 
-    line = input_file.readline()
-    while line:
-        try:
-            obj = loads(line)
-            if isVertex(obj): 
-                output_file.write(line)
             else:
-                relation_id = extractRelationID(obj)
-                pq.put((relation_id, line))
-        except:
-            print("Error in ingesting the following line:") 
-            print(line)  
+                last_data_time = time.monotonic()
+                lines = (partial_line + chunk).split(b"\n")
+                partial_line = lines.pop()
 
-        line = input_file.readline()
+            for line in lines:
+                line = line + b"\n"
+                try:
+                    (vertex, relation_id) = key_scanner.extractKey(line)
+                    if projector is not None:
+                        line = projector.project(line, vertex)
+                    if vertex:
+                        if deduplicator is None or deduplicator.newVertex(line):
+                            output_file.write(line)
+                    else:
+                        if relation_id is None:
+                            raise ValueError("Missing relation_id")
+                        writeEdges(reorder_buffer.push(relation_id, line), output_file, deduplicator)
+                except:
+                    print("Error in ingesting the following line:")
+                    print(line.decode(errors="replace"))
 
-    dumpPriorityQueue(pq, output_file)
+            output_file.flush()
 
-    output_file.close()
-    input_file.close()
+    finally:
+        writeEdges(reorder_buffer.flush(), output_file, deduplicator)
+        output_file.close()
+        if not from_stdin:
+            input_file.close()
+        reorder_buffer.report()
 
 
-def main(input_log_path, output_log_name):
-    
-    readWriteLog(input_log_path, output_log_name)
+# Function to sort the logs with the reader that fits the options and the inputs
+def sortLogs(input_log_paths, output_log_name, compressed, max_memory=None, workers=1, offset_index=False, key_scanner=None, deduplicator=None, projector=None):
+
+    if offset_index and compressed:
+        print("A compressed log cannot be memory-mapped, sorting without the offset index...")
+        readWriteLog(input_log_paths, output_log_name, max_memory, key_scanner, deduplicator, projector)
+    elif offset_index:
+        readWriteLogIndexed(input_log_paths, output_log_name, key_scanner, deduplicator, projector)
+    elif workers > 1 and compressed:
+        print("A compressed log cannot be split into byte ranges, reading in a single process...")
+        readWriteLog(input_log_paths, output_log_name, max_memory, key_scanner, deduplicator, projector)
+    elif workers > 1:
+        readWriteLogParallel(input_log_paths, output_log_name, workers, max_memory, key_scanner, deduplicator, projector)
+    else:
+        readWriteLog(input_log_paths, output_log_name, max_memory, key_scanner, deduplicator, projector)
+
+
+def main(input_log_paths, output_log_name, max_memory=None, workers=1, fast_path=True, follow=False, window=FOLLOW_WINDOW, max_buffer=FOLLOW_MAX_BUFFER, flush_after=FOLLOW_FLUSH_AFTER, offset_index=False, dedup=False, dedup_capacity=DEDUP_CAPACITY, vertex_drop_keys=None, edge_drop_keys=None, vertex_keep_keys=None, edge_keep_keys=None):
+
+    input_log_paths = expandInputs(input_log_paths)
+    compressed = any(compressionOpener(input_log_path, 'rb') is not None for input_log_path in input_log_paths)
+
+    key_scanner = KeyScanner(fast_path)
+    deduplicator = Deduplicator(dedup_capacity, max_buffer if follow else None) if dedup else None
+
+    projector = None
+    if any(keys is not None for keys in (vertex_drop_keys, edge_drop_keys, vertex_keep_keys, edge_keep_keys)):
+        projector = AnnotationProjector(vertex_drop_keys, edge_drop_keys, vertex_keep_keys, edge_keep_keys)
+
+    if follow and len(input_log_paths) != 1:
+        raise Exception("Follow mode reads exactly one log")
+    if offset_index and (workers > 1 or max_memory is not None):
+        raise Exception("The offset index reads in a single process and keeps no edges in memory, give it without '--workers' and '--max-memory'")
+    if offset_index and np is None:
+        raise Exception("The offset index needs numpy")
+    elif follow:
+        followLog(input_log_paths[0], output_log_name, window, max_buffer, flush_after, key_scanner, deduplicator, projector)
+    else:
+        # The sorted log is appended to the output, a failed sort puts the output back as it was
+        output_size = os.path.getsize(output_log_name) if os.path.exists(output_log_name) else None
+        try:
+            sortLogs(input_log_paths, output_log_name, compressed, max_memory, workers, offset_index, key_scanner, deduplicator, projector)
+        except BaseException:
+            restoreOutput(output_log_name, output_size)
+            raise
+
+    key_scanner.report()
+    if deduplicator is not None:
+        deduplicator.report()
+    if projector is not None:
+        projector.report()
     print("Done...")
 
 
+# Function to separate '--option value' pairs from the positional arguments
+def parseArguments(argv):
+
+    arguments = []
+    options = {"max_memory": None, "workers": 1, "fast_path": True, "follow": False, "window": FOLLOW_WINDOW, "max_buffer": FOLLOW_MAX_BUFFER, "flush_after": FOLLOW_FLUSH_AFTER, "offset_index": False, "dedup": False, "dedup_capacity": DEDUP_CAPACITY, "vertex_drop_keys": None, "edge_drop_keys": None, "vertex_keep_keys": None, "edge_keep_keys": None}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--max-memory" and index + 1 < len(argv):
+            options["max_memory"] = parseSize(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--workers" and index + 1 < len(argv):
+            options["workers"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--full-decode":
+            options["fast_path"] = False
+            index = index + 1
+        elif argv[index] == "--offset-index":
+            options["offset_index"] = True
+            index = index + 1
+        elif argv[index] == "--dedup":
+            options["dedup"] = True
+            index = index + 1
+        elif argv[index] == "--dedup-capacity" and index + 1 < len(argv):
+            options["dedup_capacity"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--follow":
+            options["follow"] = True
+            index = index + 1
+        elif argv[index] == "--window" and index + 1 < len(argv):
+            options["window"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--max-buffer" and index + 1 < len(argv):
+            options["max_buffer"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--flush-after" and index + 1 < len(argv):
+            options["flush_after"] = float(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--vertex-drop-keys" and index + 1 < len(argv):
+            options["vertex_drop_keys"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--edge-drop-keys" and index + 1 < len(argv):
+            options["edge_drop_keys"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--vertex-keep-keys" and index + 1 < len(argv):
+            options["vertex_keep_keys"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--edge-keep-keys" and index + 1 < len(argv):
+            options["edge_keep_keys"] = argv[index + 1]
+            index = index + 2
+        elif argv[index].startswith("--"):
+            raise Exception(USAGE)
+        else:
+            arguments.append(argv[index])
+            index = index + 1
+
+    return arguments, options
+
+
 if __name__ == '__main__':
     try:
-        if len(sys.argv) != 3:
-            raise Exception("run python3 sortlog.py <input_log_path> <output_log_name>")
+        arguments, options = parseArguments(sys.argv[1:])
+        if len(arguments) < 2:
+            raise Exception(USAGE)
         else:
             print("Starting...")
-            print("Input log path:", sys.argv[1])
-            print("Output log name:", sys.argv[2])
-            main(sys.argv[1], sys.argv[2])
-        
+            print("Input log path:", " ".join(arguments[:-1]))
+            print("Output log name:", arguments[-1])
+            if options["max_memory"] is not None:
+                print("Max memory:", options["max_memory"], "bytes")
+            if options["workers"] > 1:
+                print("Workers:", options["workers"])
+            if options["follow"]:
+                print("Following with a window of", options["window"], "relation ids")
+            main(arguments[:-1], arguments[-1], **options)
+
     except KeyboardInterrupt:
         print("Exiting...")
         try:
             sys.exit(0)
         except SystemExit:
-            os._exit(0)
\ No newline at end of file
+            os._exit(0)
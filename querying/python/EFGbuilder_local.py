@@ -0,0 +1,430 @@
+from multiprocessing import get_context
+from collections import deque
+from importlib import util
+import json
+import sys
+import os
+
+from EFGquerygenerator_spade import streamEntities
+
+'''
+ --------------------------------------------------------------------------------
+ @What it does?
+    The following Python module is designed to build the entity flow graphs
+    of base_template without SPADE. It loads a sorted CamFlow log (see
+    sortlog_camflow.py) into an in-memory graph with adjacency lists and
+    indexes on object_type and (boot_id, cf:machine_id, object_id), reads
+    the readers and writers of every entity from the JSON file output from
+    SPADE's CrossNamespaces filter, and evaluates the queries of
+    base_template for every entity. Every EFG is written as a SPADE JSON
+    export named <boot_id>_<machine_id>_<object_id>_<number>_graph.json, as
+    the SPADE queries of EFGquerygenerator_spade.py would, together with a
+    list of the written files for extract_privilegedflow.py.
+
+    The queries mirror SPADE's: getPath keeps the vertices and edges of the
+    paths (following the direction of the edges) no longer than the given
+    length, getLineage walks the given number of levels towards the
+    ancestors ('a') or descendants ('d'), and getMatch keeps the vertices of
+    both graphs that have the same values for the given annotations.
+    $base2 is built while loading: only the first edge between two vertices
+    for every 'relation_type' is kept. The EFGs are $transformed_subgraph,
+    merged on the keys of base_template by mergevertex_efg.py, which is
+    loaded from transforming/python of this repository unless --no-transform
+    is given.
+
+ @When should you use it?
+    If you wish to build many EFGs on one machine without running SPADE and
+    a query script then this Python module can help you build them in
+    parallel straight from the CamFlow log.
+
+ @Options
+    --jobs <N>          Build the EFGs in N processes. The graph is loaded
+                        once and shared with the processes by fork.
+    --output-dir <dir>  Directory of the EFGs and of the list file efgs.txt
+                        (default output_graph).
+    --no-transform      Write $subgraph, without merging the vertices.
+
+ @authors
+    Shahpar Khan, Mashal Abbas
+ --------------------------------------------------------------------------------
+'''
+
+USAGE = "run python3 EFGbuilder_local.py [--jobs <N>] [--output-dir <dir>] [--no-transform] <sorted_camflow_log_path> <input_json_path>"
+
+OUTPUT_DIR = "output_graph"
+LIST_NAME = "efgs.txt"
+
+# Annotations identifying an entity, also the ones matched by getMatch in base_template
+ENTITY_KEYS = ("boot_id", "cf:machine_id", "object_id")
+
+# Graph loaded by main and shared with the worker processes
+GRAPH = None
+
+# mergevertex_efg.py writes $transformed_subgraph, it is loaded from its path so the output does not depend on the Python path
+MERGEVERTEX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "transforming", "python", "mergevertex_efg.py")
+
+
+# Function to load mergevertex_efg.py from the repository --- None if it is not there
+def loadMergeVertex(path=MERGEVERTEX_PATH):
+
+    if not os.path.exists(path):
+        return None
+
+    spec = util.spec_from_file_location("mergevertex_efg", path)
+    module = util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+mergevertex_efg = loadMergeVertex()
+
+
+# Class for the whole CamFlow graph ($base2)
+#   vertices       : id -> vertex JSON object
+#   edges          : edge JSON objects, referred to by their index
+#   out_edges      : id -> indexes of the edges leaving the vertex
+#   in_edges       : id -> indexes of the edges entering the vertex
+#   by_object_type : object_type -> ids of the vertices
+#   by_entity      : (boot_id, cf:machine_id, object_id) -> ids of the vertices
+#   variables      : vertex ids of the variables shared by all EFGs ($memorys, $paths, $argvs, ...)
+class Graph:
+    __slots__ = ("vertices", "edges", "out_edges", "in_edges", "by_object_type", "by_entity", "variables", "collapsed")
+
+    def __init__(self):
+        self.vertices = {}
+        self.edges = []
+        self.out_edges = {}
+        self.in_edges = {}
+        self.by_object_type = {}
+        self.by_entity = {}
+        self.variables = {}
+        self.collapsed = set()
+
+    def addVertex(self, obj):
+        id = sys.intern(obj["id"])
+        annotations = obj.get("annotations", {})
+
+        self.vertices[id] = obj
+        self.by_object_type.setdefault(annotations.get("object_type"), []).append(id)
+        self.by_entity.setdefault(self.entity(id), []).append(id)
+
+    # Edges are collapsed on 'relation_type' as $base.collapseEdge('relation_type') does; edges of unknown vertices are dropped
+    def addEdge(self, obj):
+        from_id = obj.get("from")
+        to_id = obj.get("to")
+        if from_id not in self.vertices or to_id not in self.vertices:
+            return
+
+        key = (from_id, to_id, obj.get("annotations", {}).get("relation_type"))
+        if key in self.collapsed:
+            return
+        self.collapsed.add(key)
+
+        index = len(self.edges)
+        self.edges.append(obj)
+        self.out_edges.setdefault(sys.intern(from_id), []).append(index)
+        self.in_edges.setdefault(sys.intern(to_id), []).append(index)
+
+    # Function to return the (boot_id, cf:machine_id, object_id) of a vertex
+    def entity(self, id):
+        annotations = self.vertices[id].get("annotations", {})
+        return tuple(annotations.get(key) for key in ENTITY_KEYS)
+
+    # Function to return the ids of the vertices with the given object_type
+    def objectType(self, object_type):
+        return set(self.by_object_type.get(object_type, []))
+
+
+# Function to load a sorted CamFlow log (or a SPADE JSON export); vertices come first so every edge finds its vertices
+def loadLog(log_path):
+
+    graph = Graph()
+
+    with open(log_path, 'r') as f:
+        for line in f:
+            line = line.strip().strip(",")
+            if not line or line in ("[", "]"):
+                continue
+
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                print("Error in reading the following line:")
+                print(line)
+                continue
+
+            if "from" in obj and "to" in obj:
+                graph.addEdge(obj)
+            else:
+                graph.addVertex(obj)
+
+    # Only needed while loading
+    graph.collapsed = set()
+
+    # General SPADE variables (writeGeneralSpadeVars) and the ones of base_template that do not depend on the entity
+    graph.variables["memorys"] = graph.objectType('process_memory')
+    graph.variables["paths"] = graph.objectType('path')
+    graph.variables["argvs"] = graph.objectType('argv')
+    graph.variables["all_process_memory_version_0"] = {id for id in graph.variables["memorys"] if graph.vertices[id].get("annotations", {}).get("version") == '0'}
+
+    return graph
+
+
+# Function to return the distance of every vertex reachable from start in at most max_length edges
+#   forward follows the direction of the edges, otherwise they are walked backwards; within limits the walk to some vertices
+def distances(graph, start, max_length, forward, within=None):
+
+    adjacency = graph.out_edges if forward else graph.in_edges
+    end = "to" if forward else "from"
+
+    distance = {id: 0 for id in start if id in graph.vertices}
+    queue = deque(distance)
+    while queue:
+        id = queue.popleft()
+        if distance[id] == max_length:
+            continue
+        for index in adjacency.get(id, ()):
+            next_id = graph.edges[index][end]
+            if next_id not in distance and (within is None or next_id in within):
+                distance[next_id] = distance[id] + 1
+                queue.append(next_id)
+
+    return distance
+
+
+# Function for $base2.getPath(sources, destinations, max_length), returns (vertex ids, edge indexes)
+#   Every vertex of a path is reached from the sources, so the walk back from the destinations stays among those
+def getPath(graph, sources, destinations, max_length):
+
+    from_sources = distances(graph, sources, max_length, True)
+    if len(destinations) < len(from_sources):
+        reached = [id for id in destinations if id in from_sources]
+    else:
+        reached = [id for id in from_sources if id in destinations]
+    to_destinations = distances(graph, reached, max_length, False, from_sources)
+
+    vertices = {id for id in from_sources if id in to_destinations and from_sources[id] + to_destinations[id] <= max_length}
+
+    edges = set()
+    for id in vertices:
+        for index in graph.out_edges.get(id, ()):
+            to_id = graph.edges[index]["to"]
+            if to_id in to_destinations and from_sources[id] + 1 + to_destinations[to_id] <= max_length:
+                edges.add(index)
+
+    return vertices, edges
+
+
+# Function for $base2.getPath(sources, first_destinations, first_length, second_destinations, second_length)
+#   SPADE walks sources -> first_destinations -> second_destinations, the second part starts at the first destinations reached
+def getPathThrough(graph, sources, first_destinations, first_length, second_destinations, second_length):
+
+    first_paths = getPath(graph, sources, first_destinations, first_length)
+    reached = first_paths[0] & first_destinations
+
+    return union(first_paths, getPath(graph, reached, second_destinations, second_length))
+
+
+# Function for $base2.getLineage(start, depth, direction), returns (vertex ids, edge indexes)
+def getLineage(graph, start, depth, direction):
+
+    forward = direction == 'a'
+    adjacency = graph.out_edges if forward else graph.in_edges
+    end = "to" if forward else "from"
+
+    vertices = {id for id in start if id in graph.vertices}
+    edges = set()
+    level = vertices
+    for _ in range(depth):
+        next_level = set()
+        for id in level:
+            for index in adjacency.get(id, ()):
+                edges.add(index)
+                next_id = graph.edges[index][end]
+                if next_id not in vertices:
+                    next_level.add(next_id)
+        vertices |= next_level
+        level = next_level
+
+    return vertices, edges
+
+
+# Function for $a.getMatch($b, 'object_id', 'cf:machine_id', 'boot_id'), returns the vertex ids of both graphs matching one of the other
+#   b is the small side, the vertices of a with the same values are found through by_entity
+def getMatch(graph, a, b):
+
+    vertices = set()
+    for id in b:
+        matches = [match for match in graph.by_entity.get(graph.entity(id), ()) if match in a]
+        if matches:
+            vertices.add(id)
+            vertices.update(matches)
+
+    return vertices
+
+
+# Function to unite (vertex ids, edge indexes) graphs
+def union(*graphs):
+
+    vertices = set()
+    edges = set()
+    for (graph_vertices, graph_edges) in graphs:
+        vertices |= graph_vertices
+        edges |= graph_edges
+
+    return vertices, edges
+
+
+# Function that evaluates base_template for an entity, returns the $subgraph as (vertex ids, edge indexes)
+def buildEFG(graph, entity_tuple, reader_ids, writer_ids):
+
+    memorys = graph.variables["memorys"]
+    paths = graph.variables["paths"]
+    argvs = graph.variables["argvs"]
+
+    crossnamespace_entities = set(graph.by_entity.get(entity_tuple, []))
+    crossnamespace_readers = {id for id in reader_ids if id in graph.vertices}
+    crossnamespace_writers = {id for id in writer_ids if id in graph.vertices}
+
+    # 4. Construct crossnamespace path
+    connected_entities = getPath(graph, crossnamespace_entities, crossnamespace_entities, 1)
+    crossnamespace_flow_0 = getPath(graph, crossnamespace_readers, crossnamespace_entities, 1)
+    crossnamespace_flow_1 = getPath(graph, crossnamespace_entities, crossnamespace_writers, 1)
+
+    crossnamespace_path_vertices = getPath(graph, crossnamespace_entities, paths, 1)[0] & paths
+    crossnamespace_path = getPath(graph, connected_entities[0], crossnamespace_path_vertices, 1)
+
+    # 5. Adding process_memory vertices to writing and reading tasks.
+    writing_process_memory = getLineage(graph, crossnamespace_writers, 1, 'a')[0] & memorys
+    reading_process_memory = getLineage(graph, crossnamespace_readers, 1, 'd')[0] & memorys
+    writing_task_to_writing_memory = getPath(graph, crossnamespace_writers, writing_process_memory, 1)
+    reading_memory_to_reading_task = getPath(graph, reading_process_memory, crossnamespace_readers, 1)
+
+    all_process_memory_version_0 = graph.variables["all_process_memory_version_0"]
+    writing_process_memory_all_versions = getMatch(graph, all_process_memory_version_0, writing_process_memory)
+    reading_process_memory_all_versions = getMatch(graph, all_process_memory_version_0, reading_process_memory)
+
+    writing_process_memory_path = getPathThrough(graph, writing_process_memory_all_versions, writing_process_memory_all_versions, 1, paths, 1)
+    reading_process_memory_path = getPathThrough(graph, reading_process_memory_all_versions, reading_process_memory_all_versions, 1, paths, 1)
+
+    # 6. Adding argv vertices to process_memory vertices.
+    writing_process_to_argv = getPath(graph, writing_process_memory_all_versions, argvs, 1)
+    reading_process_to_argv = getPath(graph, reading_process_memory_all_versions, argvs, 1)
+
+    # 7. Cross-namespace provenance subgraph construction (edges are already collapsed on 'relation_type')
+    return union(crossnamespace_flow_0, crossnamespace_flow_1, connected_entities, crossnamespace_path, writing_task_to_writing_memory, reading_memory_to_reading_task, writing_process_memory_path, reading_process_memory_path, writing_process_to_argv, reading_process_to_argv)
+
+
+# Function to write a subgraph as a SPADE JSON export, vertices first, after $subgraph.transform(MergeVertex, ...) unless transform is False
+def writeEFG(graph, subgraph, efg_path, transform=True):
+
+    (vertices, edges) = subgraph
+
+    objects = [graph.vertices[id] for id in sorted(vertices)] + [graph.edges[index] for index in sorted(edges)]
+    if transform:
+        objects = mergevertex_efg.transformEFG(objects, mergevertex_efg.MERGE_KEYS.split(","))
+
+    with open(efg_path, 'w') as f:
+        f.write("[\n" + "\n,".join(json.dumps(obj) for obj in objects) + "\n]\n")
+
+
+# Function to build and write the EFG of one entity --- returns (efg_name, error)
+def buildTask(task):
+    (counter, entity_tuple, reader_ids, writer_ids, output_dir, transform) = task
+
+    efg_name = entity_tuple[0] + "_" + entity_tuple[1][3:] + "_" + entity_tuple[2] + "_" + str(counter) + "_graph.json"
+
+    try:
+        subgraph = buildEFG(GRAPH, entity_tuple, reader_ids, writer_ids)
+        writeEFG(GRAPH, subgraph, os.path.join(output_dir, efg_name), transform)
+    except Exception as e:
+        return efg_name, repr(e)
+
+    return efg_name, None
+
+
+def main(log_path, input_json_path, output_dir=OUTPUT_DIR, jobs=1, transform=True):
+    global GRAPH
+
+    if transform and mergevertex_efg is None:
+        raise Exception("Writing $transformed_subgraph needs " + MERGEVERTEX_PATH + ", or use --no-transform")
+
+    GRAPH = loadLog(log_path)
+    print("Graph loaded:", len(GRAPH.vertices), "vertices,", len(GRAPH.edges), "edges")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = ((counter, entity_tuple, reader_ids, writer_ids, output_dir, transform) for counter, (entity_tuple, reader_ids, writer_ids) in enumerate(streamEntities(input_json_path), 1))
+
+    if jobs > 1:
+        # fork hands the loaded graph to the workers without copying it
+        pool = get_context("fork").Pool(jobs)
+        results = pool.imap(buildTask, tasks, chunksize=4)
+    else:
+        pool = None
+        results = map(buildTask, tasks)
+
+    with open(os.path.join(output_dir, LIST_NAME), 'w') as list_file:
+        counter = 0
+        for efg_name, error in results:
+            counter = counter + 1
+            if error is not None:
+                print("Error in building graph:", efg_name)
+                print(error)
+                continue
+
+            list_file.write(efg_name + "\n")
+            print("Graph number: " + str(counter) + " done...")
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print("All graphs completed...")
+
+
+# Function to separate '--option value' pairs from the positional arguments
+def parseArguments(argv):
+
+    arguments = []
+    options = {"output_dir": OUTPUT_DIR, "jobs": 1, "transform": True}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--jobs" and index + 1 < len(argv):
+            options["jobs"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--output-dir" and index + 1 < len(argv):
+            options["output_dir"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--no-transform":
+            options["transform"] = False
+            index = index + 1
+        elif argv[index].startswith("--"):
+            raise Exception(USAGE)
+        else:
+            arguments.append(argv[index])
+            index = index + 1
+
+    return arguments, options
+
+
+if __name__ == '__main__':
+    try:
+        arguments, options = parseArguments(sys.argv[1:])
+        if len(arguments) != 2:
+            raise Exception(USAGE)
+        else:
+            print("Starting...")
+            print("Sorted CamFlow log path:", arguments[0])
+            print("Input json path:", arguments[1])
+            print("Output directory:", options["output_dir"])
+            main(arguments[0], arguments[1], **options)
+
+    except KeyboardInterrupt:
+        print("Exiting...")
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
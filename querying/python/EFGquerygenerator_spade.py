@@ -1,5 +1,6 @@
-import pandas as pd
-import numpy as np
+from itertools import chain
+import hashlib
+import json
 import sys
 import os
 
@@ -18,104 +19,215 @@ import os
     across numerous cross-namespace events then this Python module can help
     you create an iterative SPADE query for each entity that you can load into
     SPADE query client using the following command: load <query_file_path>
+
+    The JSON file is read one record at a time. Only the de-duplicated reader
+    and writer ids of every (boot_id, cf:machine_id, object_id) entity are
+    kept, so memory grows with the unique entities and ids, not with the
+    number of cross-namespace events.
+
+    Every graph exported is $transformed_subgraph. If the query template
+    does not assign it, $subgraph is exported instead, so the MergeVertex
+    transform can be removed from the template and done on the exported
+    graphs by transforming/python/mergevertex_efg.py.
+
+ @Options
+    --max-constraint-length <N>
+                Longest right-hand side of every %reader_constraintN and
+                %writer_constraintN variable (default 512). The ids are
+                packed into as few variables as fit.
+    --batch <K> Group K entities in one query block (see
+                templates/batch_template). The part of the template above
+                the '# @entity' line runs once over the union of the K
+                entities, so the expensive getLineage/getMatch/getPath
+                queries against $base2 run once per batch. The part below
+                it runs for every entity on the batch results and exports
+                its graph.
+    --manifest <path>
+                Remember every entity written to a query file in <path>,
+                with a hash of its reader and writer ids, the query
+                template, the constraint length, and the page size. A later run only
+                writes queries for the entities that are new or changed,
+                keeps their graph numbers, and writes them to a new query
+                file <output_query_filename>.<N> (the first N not used
+                yet), so SPADE only exports the delta and a delta that
+                has not been loaded yet is never overwritten. The ids are
+                hashed as sets, so reordered input is not a change, and
+                no file is written when nothing changed.
+    --page-size <N>
+                Most reader or writer ids in one getVertex query (default
+                500). An entity with more readers or writers is split into
+                pages: the part of the template above the '# @page' line
+                runs once for the entity, the part between it and the
+                '# @merge' line runs once per page, and the $subgraph of
+                all pages are united before the part below '# @merge'
+                (MergeVertex transform) and the export. Without a
+                '# @page' line everything above '# @merge' runs per page.
+                Batched mode does not page, it refuses to run, before the
+                query file is written, if an entity has more readers or
+                writers.
  
  @authors 
     Shahpar Khan, Mashal Abbas
  --------------------------------------------------------------------------------
 '''
 
+# Longest right-hand side of a %reader_constraintN / %writer_constraintN variable
+MAX_CONSTRAINT_LENGTH = 512
+
+USAGE = "run python3 EFGquerygenerator_spade.py [--max-constraint-length <N>] [--batch <K>] [--manifest <path>] [--page-size <N>] <input_json_path> <query_template_path> <output_query_filename>"
+
+# Variables created for every entity graph, erased before the next one
+VARIABLES_TO_ERASE = "$crossnamespace_entities $crossnamespace_writers $crossnamespace_readers $connected_entities $crossnamespace_flow_0 $crossnamespace_flow_1 $crossnamespace_path_vertices $crossnamespace_path $writing_process_memory $reading_process_memory $writing_task_to_writing_memory $reading_memory_to_reading_task $writing_process_memory_all_versions $reading_process_memory_all_versions $writing_process_memory_path $reading_process_memory_path $writing_process_to_argv $reading_process_to_argv $subgraph $transformed_subgraph"
+
+# Variables holding the vertices of an entity, numbered per entity and united in batched mode
+CROSSNAMESPACE_VARIABLES = ["$crossnamespace_entities", "$crossnamespace_readers", "$crossnamespace_writers"]
+
+# Most reader or writer ids selected by one getVertex query
+PAGE_SIZE = 500
+
+# Line of a query template above which the queries only depend on the entity and run once for all its pages
+PAGE_MARKER = "# @page"
+
+# Line of a query template after which the per-page subgraphs are united
+MERGE_MARKER = "# @merge"
+
+# Line of a batch template that separates the queries run once per batch from the ones run per entity
+ENTITY_MARKER = "# @entity"
+
+# Variable exported for every entity when the query template assigns it
+EXPORTED_SUBGRAPH = "$transformed_subgraph"
+
+
 # Function to create list of constraints broken down in multiple variables
-def list_constraint(full_constraint, constraint_name):
-    result = []
-    compound_result = []
-    
-    char_index = 0
-    mod_count = 0
-    start = 0
-    constraint_count = 0
-    or_index = None
-    
-    while(char_index < len(full_constraint)):
-
-        if ((mod_count % 1024 > 511)):
-
-            for reverse_index in range(char_index - 4, 0, -1):
-                if (full_constraint[reverse_index:reverse_index+4] == " or "):
-                    or_index = reverse_index
-                    break
-
-            resultant_constraint = constraint_name + str(constraint_count) + " = " + full_constraint[start:or_index]
-            result.append(resultant_constraint)
-            
-            compound_result.append(constraint_name + str(constraint_count))
-
-            constraint_count = constraint_count + 1
-            start = or_index + 4
-            mod_count = 0
-        char_index = char_index + 1
-        mod_count = mod_count + 1
-
-    
-    compound_result.append(constraint_name + str(constraint_count))
-    
-    resultant_constraint = constraint_name + str(constraint_count) + " = " + full_constraint[start:]
-    result.append(resultant_constraint)
+#   The "id" == '<id>' terms are packed in a single pass into constraints of at most max_length characters
+#   (a single term longer than that gets a constraint of its own). Returns the constraint definitions and the
+#   names of the constraints joined by 'or' and by 'and'.
+def buildConstraint(ids, constraint_name, max_length=MAX_CONSTRAINT_LENGTH):
+    constraints = []
+    terms = []
+    length = 0
+
+    for id in ids:
+        term = "\"id\" == '" + id + "'"
+
+        if terms and length + len(" or ") + len(term) > max_length:
+            constraints.append(" or ".join(terms))
+            terms = []
+            length = 0
+
+        if terms:
+            length = length + len(" or ")
+        length = length + len(term)
+        terms.append(term)
 
+    constraints.append(" or ".join(terms))
+
+    compound_result = [constraint_name + str(constraint_count) for constraint_count in range(len(constraints))]
+
+    result = "\n\n".join(name + " = " + constraint for name, constraint in zip(compound_result, constraints))
     compound_result_or = " or ".join(compound_result)
     compound_result_and = " and ".join(compound_result)
 
-    result = "\n\n".join(result)
-    
     return result, compound_result_or, compound_result_and
 
 
-# Function to create dataframes from the input JSON file
-def createDataframes(json_file_path):
-    
-    # Reading JSON file
-    df = pd.read_json(json_file_path, lines=True)
+# Function to stream the input JSON file and group the reader and writer ids of every entity
+#   Yields (entity_tuple, reader_ids, writer_ids) for the entities with at least one writer, in the order
+#   their first writer appears. The ids keep the order of their first appearance and have no duplicates.
+def streamEntities(json_file_path):
 
-    df_artifact = pd.json_normalize(df['artifact'])
-    df_artifact = df_artifact.rename(columns={"boot_id": "entity_boot_id", "cf:machine_id": "entity_cf:machine_id", "object_id": "entity_object_id"})
+    readers = {}
+    writers = {}
 
-    df_reader = pd.json_normalize(df['reader'])
+    with open(json_file_path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
 
-    df_artifact_reader = pd.concat([df_artifact, df_reader], axis=1)
+            record = json.loads(line)
+            artifact = record['artifact']
+            entity_tuple = (str(artifact['boot_id']), str(artifact['cf:machine_id']), str(artifact['object_id']))
 
-    identifier_columns = ['entity_boot_id', 'entity_cf:machine_id', 'entity_object_id']
+            # dicts with None values are used as ordered sets
+            readers.setdefault(entity_tuple, {})[str(record['reader']['id'])] = None
 
-    df_artifact_reader = df_artifact_reader.set_index(identifier_columns).sort_index()
-    df_artifact_reader_unique = df_artifact_reader.index.unique()
-    dict_dfs_readers = {}
-    for i in range(len(df_artifact_reader_unique)):
-        all_readers_of_identifier = df_artifact_reader.loc[df_artifact_reader_unique[i]]
-        all_readers_of_identifier = all_readers_of_identifier[['id']]
-        dict_dfs_readers[df_artifact_reader_unique[i]] = all_readers_of_identifier
+            for writer in record['writers']:
+                writers.setdefault(entity_tuple, {})[str(writer['id'])] = None
 
-    # extracting writers
-    list_of_list_of_writiers = []
-    for i in range(df.shape[0]):
-        df_writers_normalized = pd.json_normalize(df.iloc[i]['writers'])
-        df_writers_normalized['index'] = i
-        list_of_list_of_writiers.append(df_writers_normalized)
-    
-    writer_df = pd.concat(list_of_list_of_writiers).set_index('index')
-    writer_df = writer_df.add_prefix('writer_') 
+    for entity_tuple in writers:
+        yield entity_tuple, list(readers[entity_tuple]), list(writers[entity_tuple])
 
-    merged_artifact_writer_df = pd.merge(df_artifact, writer_df, left_index=True, right_index=True)
-    merged_artifact_writer_df = merged_artifact_writer_df.drop_duplicates().set_index(identifier_columns)
 
-    merged_artifact_writer_df_unique = merged_artifact_writer_df.index.unique()
-    list_dfs_writers= []
-    for i in range(len(merged_artifact_writer_df_unique)):
-        all_writers_of_identifier = merged_artifact_writer_df.loc[[merged_artifact_writer_df_unique[i]]]
-        try:
-            list_dfs_writers.append(all_writers_of_identifier.to_frame().reset_index())
-        except:
-            list_dfs_writers.append(all_writers_of_identifier.reset_index())
+# Class that remembers the graph number and the hash of every entity written to a query file in an append-only JSON lines file
+class EntityManifest:
+
+    def __init__(self, manifest_path):
+        self.entities = {}
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut by a crash is ignored, its entity is written again
+                        continue
+                    self.entities[tuple(record['entity'])] = (record['hash'], record['number'])
+
+        self.last_number = max([number for (_, number) in self.entities.values()] + [0])
+        self.manifest_file = open(manifest_path, 'a')
+
+    # Hash of everything the queries of an entity are made of, the ids are sorted so the order of the input does not matter
+    @staticmethod
+    def hash(reader_ids, writer_ids, query_template, max_constraint_length, page_size):
+        return hashlib.blake2b(json.dumps([sorted(reader_ids), sorted(writer_ids), query_template, max_constraint_length, page_size]).encode(), digest_size=16).hexdigest()
 
+    # Function to return the graph number of a new or changed entity --- None if it is unchanged
+    def number(self, entity_tuple, entity_hash):
+        if entity_tuple in self.entities:
+            (known_hash, number) = self.entities[entity_tuple]
+            return None if known_hash == entity_hash else number
 
-    return list_dfs_writers, dict_dfs_readers
+        self.last_number = self.last_number + 1
+        self.entities[entity_tuple] = (None, self.last_number)
+
+        return self.last_number
+
+    # Function to record an entity written to the query file at query_path
+    def put(self, entity_tuple, entity_hash, number, query_path):
+        self.entities[entity_tuple] = (entity_hash, number)
+        self.manifest_file.write(json.dumps({'entity': list(entity_tuple), 'hash': entity_hash, 'number': number, 'file': query_path}) + "\n")
+        self.manifest_file.flush()
+
+    def close(self):
+        self.manifest_file.close()
+
+
+# Function to number the streamed entities, yields (number, entity_tuple, reader_ids, writer_ids, entity_hash)
+#   Without a manifest every entity is numbered in order. With one, unchanged entities are skipped and the others keep their number.
+def numberEntities(entities, manifest, query_template, max_constraint_length=MAX_CONSTRAINT_LENGTH, page_size=PAGE_SIZE):
+
+    counter = 0
+    for entity_tuple, reader_ids, writer_ids in entities:
+        if manifest is None:
+            counter = counter + 1
+            yield counter, entity_tuple, reader_ids, writer_ids, None
+            continue
+
+        entity_hash = EntityManifest.hash(reader_ids, writer_ids, query_template, max_constraint_length, page_size)
+        number = manifest.number(entity_tuple, entity_hash)
+        if number is not None:
+            yield number, entity_tuple, reader_ids, writer_ids, entity_hash
+
+
+# Function to return the first <output_query_filename>.<N> that does not exist yet, so a run never overwrites an earlier delta
+def deltaQueryFilename(output_query_filename):
+
+    run = 1
+    while os.path.exists(output_query_filename + "." + str(run)):
+        run = run + 1
+
+    return output_query_filename + "." + str(run)
 
 
 # Function to load general query template
@@ -148,43 +260,29 @@ def writeGeneralSpadeVars(output_query_file):
     output_query_file.write("$argvs = $base2.getVertex(object_type = 'argv')\n\n")
 
 
-# Function to create entity, reader, and writer according to SPADE query surface
-def createConstraints(df, dict_dfs_readers):
+# Function to create entity, reader, and writer constraints from the reader and writer ids of an entity
+#   suffix is appended to the $crossnamespace_* variable names
+def createEntityConstraints(entity_tuple, reader_ids, writer_ids, max_constraint_length=MAX_CONSTRAINT_LENGTH, suffix=""):
 
-    entity_tuple = (str(df.iloc[0]['entity_boot_id']), str(df.iloc[0]['entity_cf:machine_id']), str(df.iloc[0]['entity_object_id'] ))
-    entity_constraint = "%entity_constraint = \"boot_id\" == '" + df.iloc[0]['entity_boot_id'] + "' and \"cf:machine_id\" == '" + df.iloc[0]['entity_cf:machine_id']  + "' and \"object_id\" == '" + df.iloc[0]['entity_object_id']  + "'\n"
-    cross_entities = "\n$crossnamespace_entities = $base2.getVertex(%entity_constraint)\n\n"
-    
-    if df.shape[0] > 500:
-        df = df.head(500)
+    entity_constraint = "%entity_constraint = \"boot_id\" == '" + entity_tuple[0] + "' and \"cf:machine_id\" == '" + entity_tuple[1]  + "' and \"object_id\" == '" + entity_tuple[2]  + "'\n"
+    cross_entities = "\n$crossnamespace_entities" + suffix + " = $base2.getVertex(%entity_constraint)\n\n"
 
     # constructing writer constraint
-    df['combined'] = "\"id\" == '" + df['writer_id'] + "'"
-    
-    writer_concat_string = ' or '.join(df['combined'])
-    writer_constraint, writer_compound_result_or, _ = list_constraint(writer_concat_string, "%writer_constraint")
-    cross_writers = "\n\n$crossnamespace_writers = $base2.getVertex(" + writer_compound_result_or + ")\n\n"
+    writer_constraint, writer_compound_result_or, _ = buildConstraint(writer_ids, "%writer_constraint", max_constraint_length)
+    cross_writers = "\n\n$crossnamespace_writers" + suffix + " = $base2.getVertex(" + writer_compound_result_or + ")\n\n"
 
     # constructing reader constraint
-    reader_df = dict_dfs_readers[entity_tuple]
-
-    if reader_df.shape[0] > 500:
-        reader_df = reader_df.head(500)
-    reader_df['combined'] = "\"id\" == '" + reader_df['id'] + "'"
-
-    reader_concat_string = ' or '.join(reader_df['combined'])
-
-    reader_constraint, reader_compound_result_or, _ = list_constraint(reader_concat_string, "%reader_constraint")
-    cross_readers = "\n\n$crossnamespace_readers = $base2.getVertex(" + reader_compound_result_or + ")\n\n"
+    reader_constraint, reader_compound_result_or, _ = buildConstraint(reader_ids, "%reader_constraint", max_constraint_length)
+    cross_readers = "\n\n$crossnamespace_readers" + suffix + " = $base2.getVertex(" + reader_compound_result_or + ")\n\n"
 
     return entity_tuple, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers
 
 
 # Function to create SPADE queries that output the graph created in SPADE query client
-def createOutputQueries(entity_tuple, counter):
+def createOutputQueries(entity_tuple, counter, exported_subgraph=EXPORTED_SUBGRAPH):
     dot_name = "\n\nexport > /home/vagrant/output_graph/" + entity_tuple[0] + "_" + entity_tuple[1][3:] + "_" + entity_tuple[2] + "_" + str(counter) + "_graph.dot"
     json_name = "\n\nexport > /home/vagrant/output_graph/" + entity_tuple[0] + "_" + entity_tuple[1][3:] + "_" + entity_tuple[2] + "_" + str(counter) + "_graph.json"
-    subgraph_dump = "\n\ndump all $transformed_subgraph"
+    subgraph_dump = "\n\ndump all " + exported_subgraph
 
     return dot_name, json_name, subgraph_dump
 
@@ -211,55 +309,314 @@ def writeGraphQueries(output_query_file, reset_workspace, entity_constraint, cro
     output_query_file.write(subgraph_dump)
 
 
-def main(input_json_path, query_template_path, output_query_filename):
+# Function to split a batch template into the queries run once per batch and the queries run per entity
+def splitBatchTemplate(query_template):
+
+    lines = query_template.split("\n")
+    for index in range(len(lines)):
+        if lines[index].strip() == ENTITY_MARKER:
+            return "\n".join(lines[:index]) + "\n", "\n".join(lines[index + 1:])
+
+    raise Exception("Batched mode needs a query template with a '" + ENTITY_MARKER + "' line (see templates/batch_template)")
+
+
+# Function to split a query template into the queries run once per entity, the ones run per page and the ones run on the united pages
+#   --- None if it has no merge line
+def splitPagedTemplate(query_template):
+
+    lines = [line.strip() for line in query_template.split("\n")]
+    if MERGE_MARKER not in lines:
+        return None
+
+    merge_index = lines.index(MERGE_MARKER)
+    page_index = lines.index(PAGE_MARKER) if PAGE_MARKER in lines[:merge_index] else -1
+
+    lines = query_template.split("\n")
+    entity_template = "\n".join(lines[:page_index]) + "\n" if page_index >= 0 else ""
+
+    return entity_template, "\n".join(lines[page_index + 1:merge_index]) + "\n", "\n".join(lines[merge_index + 1:])
+
+
+# Function to write the queries of an entity whose readers or writers do not fit in one page
+#   Every page selects at most page_size readers and writers and runs page_template, the $subgraph of the pages
+#   are united in $paged_subgraph, and merge_template runs once on the union before the export.
+#   The entity template, with the queries that only depend on the entity, is written once before the pages
+def writePagedQueries(output_query_file, reset_workspace, entity_tuple, reader_ids, writer_ids, entity_template, page_template, merge_template, counter, page_size=PAGE_SIZE, max_constraint_length=MAX_CONSTRAINT_LENGTH, exported_subgraph=EXPORTED_SUBGRAPH):
+
+    page_count = max((len(reader_ids) + page_size - 1) // page_size, (len(writer_ids) + page_size - 1) // page_size)
+
+    output_query_file.write(reset_workspace)
+
+    for page in range(page_count):
+        page_readers = reader_ids[page * page_size:(page + 1) * page_size]
+        page_writers = writer_ids[page * page_size:(page + 1) * page_size]
+
+        _, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers = createEntityConstraints(entity_tuple, page_readers, page_writers, max_constraint_length)
+
+        if page == 0:
+            output_query_file.write(entity_constraint)
+            output_query_file.write(cross_entities)
+            output_query_file.write(entity_template)
+
+        # A side with no ids left in this page selects an empty graph
+        if not page_readers:
+            reader_constraint = ""
+            cross_readers = "\n\n$crossnamespace_readers = $crossnamespace_entities - $crossnamespace_entities\n\n"
+        if not page_writers:
+            writer_constraint = ""
+            cross_writers = "\n\n$crossnamespace_writers = $crossnamespace_entities - $crossnamespace_entities\n\n"
+
+        output_query_file.write("\n\n########## Page: " + str(page + 1) + " of " + str(page_count) + " ##########\n\n")
+        output_query_file.write(reader_constraint)
+        output_query_file.write(cross_readers)
+
+        output_query_file.write(writer_constraint)
+        output_query_file.write(cross_writers)
+
+        output_query_file.write(page_template)
+
+        if page == 0:
+            output_query_file.write("\n$paged_subgraph = $subgraph\n")
+        else:
+            output_query_file.write("\n$paged_subgraph = $paged_subgraph + $subgraph\n")
+
+    output_query_file.write("$subgraph = $paged_subgraph\n")
+    output_query_file.write(merge_template)
+
+    dot_name, json_name, subgraph_dump = createOutputQueries(entity_tuple, counter, exported_subgraph)
+    output_query_file.write(dot_name)
+    output_query_file.write(subgraph_dump)
+    output_query_file.write(json_name)
+    output_query_file.write(subgraph_dump)
+
+
+# Function to list the variables assigned by a query template, in order of first assignment
+def templateVariables(query_template):
+
+    variables = []
+    for line in query_template.split("\n"):
+        line = line.strip()
+        if line.startswith("$") and "=" in line:
+            variable = line.split("=")[0].strip()
+            if variable not in variables:
+                variables.append(variable)
+
+    return variables
+
+
+# Function to name the variable exported for every entity, $subgraph when the template leaves the MergeVertex transform out
+def exportedSubgraph(query_template):
+
+    if EXPORTED_SUBGRAPH in templateVariables(query_template):
+        return EXPORTED_SUBGRAPH
+
+    return "$subgraph"
+
+
+# Function to group the streamed entities into lists of batch_size entities
+def batchEntities(entities, batch_size):
+
+    batch = []
+    for entity in entities:
+        batch.append(entity)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+# Function to refuse the numbered entities that batched mode would have to page --- returns them as a list
+#   All entities are checked before the query file is opened, so a refused run leaves no partial query file behind
+def checkBatchEntities(entities, page_size=PAGE_SIZE):
+
+    entities = list(entities)
+    for (counter, _, reader_ids, writer_ids, _) in entities:
+        if len(reader_ids) > page_size or len(writer_ids) > page_size:
+            raise Exception("Graph number: " + str(counter) + " has more than " + str(page_size) + " readers or writers, which batched mode cannot page: run it without --batch or with a larger --page-size")
+
+    return entities
+
+
+# Function to write the queries of a batch of numbered entities
+def writeBatchQueries(output_query_file, batch, batch_counter, batch_template, entity_template, max_constraint_length=MAX_CONSTRAINT_LENGTH, page_size=PAGE_SIZE, exported_subgraph=EXPORTED_SUBGRAPH):
+
+    suffixes = ["_" + str(index) for index in range(1, len(batch) + 1)]
+
+    variables_to_erase = VARIABLES_TO_ERASE.split()
+    for variable in templateVariables(batch_template + entity_template) + [variable + suffix for suffix in suffixes for variable in CROSSNAMESPACE_VARIABLES]:
+        if variable not in variables_to_erase:
+            variables_to_erase.append(variable)
+
+    output_query_file.write("\n\n########## Batch number: " + str(batch_counter) + " ##########\n\nerase " + " ".join(variables_to_erase) + "\n\n")
+
+    # Vertices of every entity in numbered variables, then their union for the queries run once per batch
+    for (counter, entity_tuple, reader_ids, writer_ids, _), suffix in zip(batch, suffixes):
+        _, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers = createEntityConstraints(entity_tuple, reader_ids, writer_ids, max_constraint_length, suffix)
+
+        output_query_file.write(entity_constraint)
+        output_query_file.write(cross_entities)
+        output_query_file.write(reader_constraint)
+        output_query_file.write(cross_readers)
+        output_query_file.write(writer_constraint)
+        output_query_file.write(cross_writers)
+
+    for variable in CROSSNAMESPACE_VARIABLES:
+        output_query_file.write(variable + " = " + " + ".join(variable + suffix for suffix in suffixes) + "\n")
+
+    output_query_file.write(batch_template)
+
+    # Graph of every entity out of the batch results
+    for (counter, entity_tuple, _, _, _), suffix in zip(batch, suffixes):
+        output_query_file.write("\n\n########## Graph number: " + str(counter) + " ##########\n\n")
+        for variable in CROSSNAMESPACE_VARIABLES:
+            output_query_file.write(variable + " = " + variable + suffix + "\n")
+
+        output_query_file.write(entity_template)
+
+        dot_name, json_name, subgraph_dump = createOutputQueries(entity_tuple, counter, exported_subgraph)
+        output_query_file.write(dot_name)
+        output_query_file.write(subgraph_dump)
+        output_query_file.write(json_name)
+        output_query_file.write(subgraph_dump)
+
+        print("Graph number: " + str(counter) + " done...")
+
+
+def main(input_json_path, query_template_path, output_query_filename, max_constraint_length=MAX_CONSTRAINT_LENGTH, batch_size=1, manifest=None, page_size=PAGE_SIZE):
 
     # Loading static query template
     query_template = loadQueryTemplate(query_template_path)
-
-    # Creating list of writer dataframes and dictionary of reader dataframes
-    list_dfs_writers, dict_dfs_readers = createDataframes(input_json_path)
-    
-    # Opening output query file
-    output_query_file = open(output_query_filename, 'a')
+    exported_subgraph = exportedSubgraph(query_template)
+
+    if batch_size > 1:
+        batch_template, entity_template = splitBatchTemplate(query_template)
+    else:
+        paged_template = splitPagedTemplate(query_template)
+
+    entity_manifest = None
+    if manifest is not None:
+        entity_manifest = EntityManifest(manifest)
+
+    entities = numberEntities(streamEntities(input_json_path), entity_manifest, query_template, max_constraint_length, page_size)
+    if batch_size > 1:
+        entities = iter(checkBatchEntities(entities, page_size))
+
+    # Opening output query file, a run with a manifest only holds the new and changed entities in a file of its own
+    if entity_manifest is not None:
+        first_entity = next(entities, None)
+        if first_entity is None:
+            print("No new or changed entities, no delta query file written")
+            entity_manifest.close()
+            return
+        entities = chain([first_entity], entities)
+
+        output_query_filename = deltaQueryFilename(output_query_filename)
+        print("Delta query file:", output_query_filename)
+        output_query_file = open(output_query_filename, 'x')
+    else:
+        output_query_file = open(output_query_filename, 'a')
 
     # Writing general SPADE variables to the query file
     writeGeneralSpadeVars(output_query_file)
 
-    counter = 0
-    variables_to_erase = "$crossnamespace_entities $crossnamespace_writers $crossnamespace_readers $connected_entities $crossnamespace_flow_0 $crossnamespace_flow_1 $crossnamespace_path_vertices $crossnamespace_path $writing_process_memory $reading_process_memory $writing_task_to_writing_memory $reading_memory_to_reading_task $writing_process_memory_all_versions $reading_process_memory_all_versions $writing_process_memory_path $reading_process_memory_path $writing_process_to_argv $reading_process_to_argv $subgraph $transformed_subgraph"
+    written = 0
+
+    # Constructing queries for batches of batch_size entities
+    if batch_size > 1:
+        batch_counter = 0
+        for batch in batchEntities(entities, batch_size):
+            batch_counter = batch_counter + 1
+            writeBatchQueries(output_query_file, batch, batch_counter, batch_template, entity_template, max_constraint_length, page_size, exported_subgraph)
+
+            output_query_file.flush()
+            for (counter, entity_tuple, _, _, entity_hash) in batch:
+                if entity_manifest is not None:
+                    entity_manifest.put(entity_tuple, entity_hash, counter, output_query_filename)
+                written = written + 1
+    else:
+        # Constructing query for each entity in a single query file, entities are streamed from the input JSON file
+        for counter, entity_tuple, reader_ids, writer_ids, entity_hash in entities:
+
+            reset_workspace = "\n\n########## Graph number: " + str(counter) + " ##########\n\nerase " + VARIABLES_TO_ERASE + "\n\n"
 
-    # Constructing query for each entity in a single query file
-    for df in list_dfs_writers:
+            paged = len(reader_ids) > page_size or len(writer_ids) > page_size
 
-        counter = counter + 1
+            if paged and paged_template is not None:
+                # Writing the queries for the current entity page by page
+                writePagedQueries(output_query_file, reset_workspace, entity_tuple, reader_ids, writer_ids, paged_template[0], paged_template[1], paged_template[2], counter, page_size, max_constraint_length, exported_subgraph)
+            else:
+                if paged:
+                    print("Graph number: " + str(counter) + " has more than " + str(page_size) + " readers or writers and the query template has no '" + MERGE_MARKER + "' line, only the first " + str(page_size) + " are kept")
+                    reader_ids = reader_ids[:page_size]
+                    writer_ids = writer_ids[:page_size]
 
-        # Creating entity, reader and, writer constraints
-        entity_tuple, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers = createConstraints(df, dict_dfs_readers)
+                # Creating entity, reader and, writer constraints
+                entity_tuple, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers = createEntityConstraints(entity_tuple, reader_ids, writer_ids, max_constraint_length)
 
-        # Constructing output svg path, svg dump command, and reset workspace command
-        dot_name, json_name, subgraph_dump = createOutputQueries(entity_tuple, counter)
-        reset_workspace = "\n\n########## Graph number: " + str(counter) + " ##########\n\nerase " + variables_to_erase + "\n\n"
+                # Constructing output svg path, svg dump command, and reset workspace command
+                dot_name, json_name, subgraph_dump = createOutputQueries(entity_tuple, counter, exported_subgraph)
 
-        # Writing all the queries for the current entity to the query file
-        writeGraphQueries(output_query_file, reset_workspace, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers, query_template, dot_name, subgraph_dump, json_name)
+                # Writing all the queries for the current entity to the query file
+                writeGraphQueries(output_query_file, reset_workspace, entity_constraint, cross_entities, reader_constraint, cross_readers, writer_constraint, cross_writers, query_template, dot_name, subgraph_dump, json_name)
 
-        print("Graph number: " + counter + " done...")
+            print("Graph number: " + str(counter) + " done...")
+
+            output_query_file.flush()
+            if entity_manifest is not None:
+                entity_manifest.put(entity_tuple, entity_hash, counter, output_query_filename)
+            written = written + 1
 
     output_query_file.close()
 
+    if entity_manifest is not None:
+        print("Entities written:", written, "--- entities in the manifest:", len(entity_manifest.entities))
+        entity_manifest.close()
+
     print("All graph queries completed...")
 
 
+# Function to separate '--option value' pairs from the positional arguments
+def parseArguments(argv):
+
+    arguments = []
+    options = {"max_constraint_length": MAX_CONSTRAINT_LENGTH, "batch_size": 1, "manifest": None, "page_size": PAGE_SIZE}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--max-constraint-length" and index + 1 < len(argv):
+            options["max_constraint_length"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--batch" and index + 1 < len(argv):
+            options["batch_size"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--manifest" and index + 1 < len(argv):
+            options["manifest"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--page-size" and index + 1 < len(argv):
+            options["page_size"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index].startswith("--"):
+            raise Exception(USAGE)
+        else:
+            arguments.append(argv[index])
+            index = index + 1
+
+    return arguments, options
+
+
 if __name__ == '__main__':
     try:
-        if len(sys.argv) != 4:
-            raise Exception("run python3 sortlog.py <input_json_path> <query_template_path> <output_query_filename>")
+        arguments, options = parseArguments(sys.argv[1:])
+        if len(arguments) != 3:
+            raise Exception(USAGE)
         else:
             print("Starting...")
-            print("Input json path:", sys.argv[1])
-            print("Query template path:", sys.argv[2])
-            print("Output query filename:", sys.argv[3])
-            main(sys.argv[1], sys.argv[2], sys.argv[3])
+            print("Input json path:", arguments[0])
+            print("Query template path:", arguments[1])
+            print("Output query filename:", arguments[2])
+            main(arguments[0], arguments[1], arguments[2], **options)
         
     except KeyboardInterrupt:
         print("Exiting...")
@@ -0,0 +1,77 @@
+from tempfile import TemporaryDirectory
+import unittest
+import json
+import os
+
+import EFGbuilder_local
+
+
+# Function to create a CamFlow vertex
+def vertex(id, object_type, object_id, version="0"):
+    return {"type": "Entity", "id": id, "annotations": {"object_type": object_type, "boot_id": "1", "cf:machine_id": "cf:2", "object_id": object_id, "version": version}}
+
+
+# Function to create a CamFlow edge
+def edge(id, from_id, to_id, relation_type):
+    return {"type": "Used", "id": id, "from": from_id, "to": to_id, "annotations": {"relation_id": id[1:], "relation_type": relation_type, "from_type": "task"}}
+
+
+class TestBuildEFG(unittest.TestCase):
+
+    # An entity written by a task whose process memory has two versions, the first one named after its executable
+    def setUp(self):
+        objects = [
+            vertex("file", "file", "10"),
+            vertex("writer", "task", "20"),
+            vertex("reader", "task", "30"),
+            vertex("mem_w", "process_memory", "40", "0"),
+            vertex("mem_w1", "process_memory", "40", "1"),
+            vertex("exe_path", "path", "50"),
+            edge("e1", "file", "writer", "write"),
+            edge("e2", "reader", "file", "read"),
+            edge("e3", "writer", "mem_w1", "ref"),
+            edge("e4", "mem_w1", "mem_w", "version"),
+            edge("e5", "mem_w", "exe_path", "named"),
+        ]
+
+        self.directory = TemporaryDirectory()
+        log_path = os.path.join(self.directory.name, "log.json")
+        with open(log_path, "w") as f:
+            f.write("\n".join(json.dumps(obj) for obj in objects) + "\n")
+
+        self.graph = EFGbuilder_local.loadLog(log_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_process_memory_path(self):
+        (vertices, edges) = EFGbuilder_local.buildEFG(self.graph, ("1", "cf:2", "10"), ["reader"], ["writer"])
+        edge_ids = {self.graph.edges[index]["id"] for index in edges}
+
+        # $writing_process_memory_path walks memory -> memory version -> path
+        self.assertIn("exe_path", vertices)
+        self.assertIn("mem_w", vertices)
+        self.assertIn("e4", edge_ids)
+        self.assertIn("e5", edge_ids)
+
+    def test_get_path_through(self):
+        memories = {"mem_w", "mem_w1"}
+        (vertices, _) = EFGbuilder_local.getPathThrough(self.graph, memories, memories, 1, {"exe_path"}, 1)
+
+        self.assertEqual(vertices, {"mem_w", "mem_w1", "exe_path"})
+
+    # The transform is found without transforming/python on the Python path
+    def test_transformed_efg(self):
+        efg_path = os.path.join(self.directory.name, "efg.json")
+        (vertices, edges) = EFGbuilder_local.buildEFG(self.graph, ("1", "cf:2", "10"), ["reader"], ["writer"])
+        EFGbuilder_local.writeEFG(self.graph, (vertices, edges), efg_path)
+
+        with open(efg_path) as f:
+            ids = {obj["id"] for obj in json.load(f)}
+
+        # Both versions of the process memory are merged into one vertex
+        self.assertEqual(len(ids & {"mem_w", "mem_w1"}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
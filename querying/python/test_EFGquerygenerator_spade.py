@@ -0,0 +1,83 @@
+from tempfile import TemporaryDirectory
+import contextlib
+import unittest
+import json
+import io
+import os
+
+import EFGquerygenerator_spade
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+# Function to create a CrossNamespaces record: one reader of an entity and its writers
+def record(object_id, reader_id, writer_ids):
+    return {"artifact": {"boot_id": "1", "cf:machine_id": "cf:2", "object_id": object_id}, "reader": {"id": reader_id}, "writers": [{"id": writer_id} for writer_id in writer_ids]}
+
+
+class TestQueryGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.input_path = os.path.join(self.directory.name, "crossnamespaces.json")
+        self.output_path = os.path.join(self.directory.name, "queries")
+        self.manifest_path = os.path.join(self.directory.name, "manifest.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_input(self, records):
+        with open(self.input_path, "w") as f:
+            f.write("\n".join(json.dumps(r) for r in records) + "\n")
+
+    def run_generator(self, template="base_template", **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            EFGquerygenerator_spade.main(self.input_path, os.path.join(TEMPLATES_PATH, template), self.output_path, **options)
+
+    def test_manifest_delta(self):
+        records = [record("10", "r1", ["w1", "w2"]), record("10", "r2", ["w3"]), record("20", "r3", ["w4"])]
+        self.write_input(records)
+        self.run_generator(manifest=self.manifest_path)
+        self.assertTrue(os.path.exists(self.output_path + ".1"))
+
+        # The same ids in another order are no change, so no delta file is written
+        self.write_input(list(reversed(records)))
+        self.run_generator(manifest=self.manifest_path)
+        self.assertFalse(os.path.exists(self.output_path + ".2"))
+
+        # Only the changed entity is written, under its first graph number
+        self.write_input(records + [record("20", "r4", ["w4"])])
+        self.run_generator(manifest=self.manifest_path)
+        with open(self.output_path + ".2") as f:
+            delta = f.read()
+        self.assertIn("Graph number: 2 ", delta)
+        self.assertNotIn("Graph number: 1 ", delta)
+
+    def test_paged_entity_queries(self):
+        self.write_input([record("10", "r" + str(index), ["w" + str(index)]) for index in range(5)])
+        self.run_generator(page_size=2)
+        with open(self.output_path) as f:
+            queries = f.read()
+
+        # The queries that only depend on the entity run once, the ones on the readers and writers once per page
+        self.assertEqual(queries.count("########## Page: "), 3)
+        self.assertEqual(queries.count("$connected_entities = "), 1)
+        self.assertEqual(queries.count("$crossnamespace_path = "), 1)
+        self.assertEqual(queries.count("$crossnamespace_flow_0 = "), 3)
+        self.assertLess(queries.index("$connected_entities = "), queries.index("########## Page: 1 "))
+
+    def test_batch_refuses_large_entity(self):
+        self.write_input([record("10", "r1", ["w1"]), record("20", "r2", ["w2"]), record("20", "r3", ["w3"]), record("20", "r4", ["w4"])])
+        with open(self.output_path, "w") as f:
+            f.write("# earlier queries\n")
+
+        with self.assertRaises(Exception):
+            self.run_generator("batch_template", batch_size=2, page_size=2)
+
+        # Nothing is appended to the query file
+        with open(self.output_path) as f:
+            self.assertEqual(f.read(), "# earlier queries\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+from multiprocessing import get_context
+import json
+import sys
+import os
+
+'''
+ --------------------------------------------------------------------------------
+ @What it does?
+    The following Python module does what $subgraph.transform(MergeVertex, ...)
+    followed by collapseEdge('relation_type') does in SPADE, on EFGs that are
+    already exported as JSON. Vertices with the same values for the merge keys
+    are merged into the first of them, which loses the annotations whose
+    values differ across the merged vertices (as MergeVertex.java does, a value
+    is kept if the other one contains it). Edges are moved to the merged
+    vertices, the ones that become loops or lose a vertex are dropped, and
+    only the first edge between two vertices for every 'relation_type' is
+    kept. Vertices and edges are looked up in dicts, so an EFG is transformed
+    in one pass over its vertices and one over its edges.
+
+    The merged vertex keeps the id of the first vertex merged into it, SPADE
+    gives it the hash of its annotations instead.
+
+ @When should you use it?
+    If the query template exports $subgraph instead of $transformed_subgraph
+    (remove the transform and the collapseEdge after it from the template,
+    EFGquerygenerator_spade.py then exports $subgraph), this Python module
+    applies the transform to all the EFGs afterwards, in parallel, without
+    the MergeVertex transformer.
+
+ @Options
+    --keys <k1,k2,...>  Annotations to merge the vertices on (default the
+                        ones of base_template)
+    --jobs <N>          Transform the EFGs in N processes
+    --output-dir <dir>  Directory of the transformed EFGs and of a copy of
+                        the list file (default transformed_graph)
+
+ @authors
+    Shahpar Khan, Mashal Abbas
+ --------------------------------------------------------------------------------
+'''
+
+USAGE = "run python3 mergevertex_efg.py [--keys <k1,k2,...>] [--jobs <N>] [--output-dir <dir>] <filepath>"
+
+# Merge keys of base_template
+MERGE_KEYS = "boot_id,cf:machine_id,object_id,pidns,ipcns,mntns,netns,cgroupns,utsns"
+
+OUTPUT_DIR = "transformed_graph"
+
+
+# Function to create the hash of a vertex by concatenating the values of the merge keys, as MergeVertex.java does
+def vertexHash(vertex, keys):
+
+    annotations = vertex.get("annotations", {})
+
+    return "".join(str(annotations[key]) + "," for key in keys if annotations.get(key))
+
+
+# Function to merge the vertices on the given keys --- returns (vertices, edges, vertex hash of every id)
+def mergeVertices(objects, keys):
+
+    merged = {}
+    hashes = {}
+    edges = []
+
+    for obj in objects:
+        if "from" in obj and "to" in obj:
+            edges.append(obj)
+            continue
+
+        hash = vertexHash(obj, keys)
+        if not hash:
+            continue
+        hashes[obj["id"]] = hash
+
+        if hash not in merged:
+            merged[hash] = dict(obj, annotations=dict(obj.get("annotations", {})))
+        else:
+            # Removing the annotations that have differing values across the merged vertices
+            merged_annotations = merged[hash]["annotations"]
+            annotations = obj.get("annotations", {})
+            for key in list(merged_annotations):
+                value = annotations.get(key)
+                if value is not None and merged_annotations[key] is not None and str(merged_annotations[key]) not in str(value):
+                    del merged_annotations[key]
+
+    return merged, edges, hashes
+
+
+# Function to move the edges to the merged vertices, dropping loops and edges of vertices without a hash
+def mergeEdges(merged, edges, hashes):
+
+    merged_edges = []
+    for edge in edges:
+        from_hash = hashes.get(edge["from"])
+        to_hash = hashes.get(edge["to"])
+        if from_hash is None or to_hash is None or from_hash == to_hash:
+            continue
+
+        merged_edges.append(dict(edge, **{"from": merged[from_hash]["id"], "to": merged[to_hash]["id"]}))
+
+    return merged_edges
+
+
+# Function for collapseEdge(key): keeps the first edge between two vertices for every value of the key
+def collapseEdges(edges, key="relation_type"):
+
+    seen = set()
+    collapsed = []
+    for edge in edges:
+        edge_key = (edge["from"], edge["to"], edge.get("annotations", {}).get(key))
+        if edge_key not in seen:
+            seen.add(edge_key)
+            collapsed.append(edge)
+
+    return collapsed
+
+
+# Function that transforms the objects of an EFG --- returns the vertices followed by the edges
+def transformEFG(objects, keys):
+
+    merged, edges, hashes = mergeVertices(objects, keys)
+    edges = collapseEdges(mergeEdges(merged, edges, hashes))
+
+    return list(merged.values()) + edges
+
+
+# Function to write objects as a SPADE JSON export
+def writeObjects(objects, efg_path):
+
+    with open(efg_path, 'w') as f:
+        f.write("[\n" + "\n,".join(json.dumps(obj) for obj in objects) + "\n]\n")
+
+
+# Function to transform one EFG file into the output directory --- returns (efg_path, error)
+def transformTask(task):
+    (efg_path, keys, output_dir) = task
+
+    try:
+        with open(efg_path, 'r') as f:
+            objects = json.load(f)
+        writeObjects(transformEFG(objects, keys), os.path.join(output_dir, os.path.basename(efg_path)))
+    except Exception as e:
+        return efg_path, repr(e)
+
+    return efg_path, None
+
+
+def main(filepath, keys=MERGE_KEYS, jobs=1, output_dir=OUTPUT_DIR):
+
+    keys = keys.split(",")
+    os.makedirs(output_dir, exist_ok=True)
+
+    with open(filepath, 'r') as f:
+        efg_paths = [line.strip() for line in f if line.strip()]
+
+    tasks = [(efg_path, keys, output_dir) for efg_path in efg_paths]
+
+    if jobs > 1:
+        with get_context("spawn").Pool(jobs) as pool:
+            results = pool.map(transformTask, tasks)
+    else:
+        results = [transformTask(task) for task in tasks]
+
+    # The list file is copied with the EFGs that could be transformed
+    transformed = 0
+    with open(os.path.join(output_dir, os.path.basename(filepath)), 'w') as list_file:
+        for efg_path, error in results:
+            if error is not None:
+                print("Error in transforming file:", efg_path)
+                print(error)
+                continue
+
+            list_file.write(os.path.basename(efg_path) + "\n")
+            transformed = transformed + 1
+
+    print("**********", transformed, "JSON file(s) transformed **********")
+    if transformed < len(efg_paths):
+        print("**********", len(efg_paths) - transformed, "JSON file(s) failed **********")
+
+
+# Function to separate '--option value' pairs from the positional arguments
+def parseArguments(argv):
+
+    arguments = []
+    options = {"keys": MERGE_KEYS, "jobs": 1, "output_dir": OUTPUT_DIR}
+
+    index = 0
+    while index < len(argv):
+        if argv[index] == "--keys" and index + 1 < len(argv):
+            options["keys"] = argv[index + 1]
+            index = index + 2
+        elif argv[index] == "--jobs" and index + 1 < len(argv):
+            options["jobs"] = int(argv[index + 1])
+            index = index + 2
+        elif argv[index] == "--output-dir" and index + 1 < len(argv):
+            options["output_dir"] = argv[index + 1]
+            index = index + 2
+        elif argv[index].startswith("--"):
+            raise Exception(USAGE)
+        else:
+            arguments.append(argv[index])
+            index = index + 1
+
+    return arguments, options
+
+
+if __name__ == '__main__':
+    try:
+        arguments, options = parseArguments(sys.argv[1:])
+        if len(arguments) != 1:
+            raise Exception(USAGE)
+        else:
+            print("Starting...")
+            print("EFG list path:", arguments[0])
+            print("Merge keys:", options["keys"])
+            print("Output directory:", options["output_dir"])
+            main(arguments[0], **options)
+
+    except KeyboardInterrupt:
+        print("Exiting...")
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)